@@ -3,15 +3,22 @@
 import pform as form
 
 #
-from ptahcms.security import wrap, action
+from ptahcms.security import wrap, action, filter_permitted
+from ptahcms.security import check_permission
 from ptahcms.interfaces import Error, NotFound, Forbidden
 
 # base content classes
 from ptahcms.node import Node
 from ptahcms.node import load
 from ptahcms.node import load_parents
+from ptahcms.node import resolve_many
 from ptahcms.node import get_policy, set_policy
 
+# materialized local roles
+from ptahcms.localroles import LocalRole
+from ptahcms.localroles import get_node_roles
+from ptahcms.localroles import get_principal_nodes
+
 from ptahcms.content import Content
 from ptahcms.content import BaseContent
 from ptahcms.container import Container
@@ -32,7 +39,9 @@ from ptahcms.traverser import ContentTraverser
 
 # blob storage
 from ptahcms.blob import blob_storage
+from ptahcms.blobfs import blobfs_storage
 from ptahcms.interfaces import IBlob
+from ptahcms.interfaces import IFSBlob
 from ptahcms.interfaces import IBlobStorage
 
 # schemas
@@ -1,17 +1,56 @@
 """ blob storage implementation """
-import os
+import hashlib
+import tempfile
 import sqlalchemy as sqla
-from pyramid.compat import text_type
+from datetime import datetime
+from pyramid.compat import text_type, binary_type, string_types
+from pyramid.threadlocal import get_current_registry
 from zope.interface import implementer
 
 import ptah
-from ptahcms.node import Node
-from ptahcms.interfaces import IBlob, IBlobStorage
+from ptahcms.node import Node, node_query, idmap_get, idmap_add
+from ptahcms.settings import CFG_ID_CMS
+from ptahcms.interfaces import NotFound, Error, IBlob, IBlobStorage
+
+
+class BlobPayload(ptah.get_base()):
+    """ chunked blob data, in deduplication mode payload is shared
+    by all blobs with same data. `refs` is number of blobs which
+    reference payload. """
+
+    __tablename__ = 'ptahcms_blob_payloads'
+
+    id = sqla.Column(sqla.Integer, primary_key=True)
+    hash = sqla.Column(sqla.String(64), index=True)
+    size = sqla.Column(sqla.BigInteger, default=0)
+    chunksize = sqla.Column(sqla.Integer, default=0)
+    refs = sqla.Column(sqla.Integer, default=0)
+
+
+class BlobChunk(ptah.get_base()):
+    """ fixed-size part of blob payload """
+
+    __tablename__ = 'ptahcms_blob_chunks'
+
+    payload_id = sqla.Column(
+        sqla.Integer,
+        sqla.ForeignKey('ptahcms_blob_payloads.id', ondelete='CASCADE'),
+        primary_key=True)
+    seq = sqla.Column(sqla.Integer, primary_key=True, autoincrement=False)
+    data = sqla.Column(sqla.LargeBinary)
 
 
 @implementer(IBlob)
 class Blob(Node):
-    """ simple blob implementation """
+    """ simple blob implementation
+
+    Data is stored as payload in `ptahcms_blob_chunks` table by chunks
+    of `ptahcms.blob_chunk_size` bytes. If chunk size is 0, data is stored
+    in `data` column. `chunksize` is chunk size of stored data, 0 for
+    blobs which store data in `data` column. `hash` is sha256 hex digest
+    of data, it is None after append to chunked data. `modified` is time
+    of last write.
+    """
 
     __tablename__ = 'ptahcms_blobs'
     __mapper_args__ = {'polymorphic_identity': 'blob-sql'}
@@ -22,15 +61,69 @@ class Blob(Node):
 
     mimetype = sqla.Column(sqla.String(128), default=text_type(''))
     filename = sqla.Column(sqla.String(255), default=text_type(''))
-    size = sqla.Column(sqla.Integer, default=0)
+    size = sqla.Column(sqla.BigInteger, default=0)
+    chunksize = sqla.Column(sqla.Integer, default=0)
+    payload_id = sqla.Column(
+        'payload', sqla.Integer, sqla.ForeignKey('ptahcms_blob_payloads.id'))
+    hash = sqla.Column(sqla.String(64))
+    modified = sqla.Column(sqla.DateTime)
     data = sqla.orm.deferred(sqla.Column(sqla.LargeBinary))
 
+    _sql_chunk = sqla.sql.select(
+        [BlobChunk.data],
+        sqla.sql.and_(BlobChunk.payload_id == sqla.sql.bindparam('id'),
+                      BlobChunk.seq == sqla.sql.bindparam('seq')))
+
     def read(self):
-        return self.data
+        if not self.chunksize:
+            return self.data
+
+        return binary_type().join(self.iterdata())
+
+    def iterdata(self, start=0, stop=None):
+        """ Iterate over blob data from `start` to `stop` byte. Chunked
+        data is loaded from database by one chunk, only chunks of
+        requested range are loaded. :py:class:`ptahcms.Error` is raised
+        if chunk is missing. """
+        size = self.size or 0
+        if stop is None or stop > size:
+            stop = size
+        if start >= stop:
+            return
+
+        if not self.chunksize:
+            data = self.data
+            if data:
+                yield data[start:stop] if start or stop < len(data) else data
+            return
+
+        chunksize = self.chunksize
+        Session = ptah.get_session()
+        for seq in range(start // chunksize, -(-stop // chunksize)):
+            chunk = Session.execute(
+                self._sql_chunk, {'id': self.payload_id, 'seq': seq}).scalar()
+            if chunk is None:
+                raise Error("Blob data is truncated, chunk %s of %s "
+                            "is missing"%(seq, self.__uri__))
+
+            offset = seq * chunksize
+            if offset < start or offset + len(chunk) > stop:
+                chunk = chunk[max(start - offset, 0):stop - offset]
+            yield chunk
 
     def write(self, data):
-        self.data = data
-        self.size = len(data)
+        """ Write blob data, `data` is bytes or file-like object. With
+        `ptahcms.blob_dedup` setting payload is shared with other blobs
+        with same data. """
+        with self.writer() as writer:
+            if hasattr(data, 'read'):
+                writer.write_from(data)
+            else:
+                writer.write(data)
+
+    def writer(self, append=False):
+        """ Streaming writer of blob data, see :py:class:`BlobWriter` """
+        return BlobWriter(self, append)
 
     def updateMetadata(self, mimetype=None, filename=None, **md):
         if mimetype is not None:
@@ -48,16 +141,119 @@ class Blob(Node):
         return info
 
 
+class BlobWriter(object):
+    """ Streaming writer of blob data. Chunked data is written to storage
+    as soon as chunk is filled, in deduplication mode data is stored on
+    close if there is no payload with same data. Blob is updated and
+    previous payload is released when writer is closed. Writer is
+    a context manager, on error written data is discarded.
+
+    In append mode new chunks are added to not shared chunked payload,
+    existing chunks are not rewritten and hash of data is not computed.
+    Other data is copied to new payload.
+
+    :param blob: Blob object
+    :param append: Start with current blob data
+    """
+
+    blocksize = 65536
+
+    def __init__(self, blob, append=False):
+        cfg = ptah.get_settings(CFG_ID_CMS)
+
+        self.blob = blob
+        self.dedup = cfg['blob_dedup']
+        self.session = ptah.get_session()
+        self.payload = None
+        self.data = []
+
+        if append and blob.chunksize and blob.payload_id and \
+                payload_refs(self.session, blob.payload_id) == 1:
+            self.payload = PayloadWriter.reopen(
+                self.session, blob.payload_id, blob.chunksize, blob.size or 0)
+            return
+
+        if cfg['blob_chunk_size']:
+            self.payload = PayloadWriter(
+                self.session, cfg['blob_chunk_size'], self.dedup)
+
+        if append:
+            for data in blob.iterdata():
+                self.write(data)
+
+    def write(self, data):
+        if self.payload is not None:
+            self.payload.write(data)
+        else:
+            self.data.append(data)
+
+    def write_from(self, f):
+        """ Write all data from file-like object """
+        while True:
+            data = f.read(self.blocksize)
+            if not data:
+                break
+            self.write(data)
+
+    def close(self):
+        blob = self.blob
+        old = blob.payload_id if blob.chunksize else None
+
+        blob.modified = datetime.utcnow()
+        if self.payload is None:
+            data = binary_type().join(self.data)
+            blob.data = data
+            blob.size = len(data)
+            blob.chunksize = 0
+            blob.payload_id = None
+            blob.hash = hashlib.sha256(data).hexdigest()
+        else:
+            blob.data = None
+            blob.payload_id, blob.size, blob.hash, blob.chunksize = \
+                self.payload.close()
+
+        if old is not None and old != blob.payload_id:
+            self.session.flush()
+            release_payload(self.session, old)
+
+    def abort(self):
+        if self.payload is not None:
+            self.payload.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class BlobIter(object):
+    """ WSGI iterator over blob data. Supports webob range requests,
+    only requested part of data is loaded. """
+
+    def __init__(self, blob):
+        self.blob = blob
+
+    def __iter__(self):
+        return iter(self.blob.iterdata())
+
+    def app_iter_range(self, start, stop):
+        return self.blob.iterdata(start, stop)
+
+
 @implementer(IBlobStorage)
 class BlobStorage(object):
     """ simple blob storage """
 
     _sql_get = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(Blob)
+        lambda: node_query(Blob)
             .filter(Blob.__uri__ == sqla.sql.bindparam('uri')))
 
     _sql_get_by_parent = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(Blob)
+        lambda: node_query(Blob)
             .filter(Blob.__parent_uri__ == sqla.sql.bindparam('parent')))
 
     def create(self, parent=None):
@@ -72,29 +268,367 @@ class BlobStorage(object):
         blob = self.create(parent)
 
         data.seek(0)
-
-        blob.data = data.read()
+        blob.write(data)
         blob.updateMetadata(**metadata)
 
-        data.seek(0, os.SEEK_END)
-        blob.size = data.tell()
-
         return blob
 
     def get(self, uri):
         """SQL Blob resolver"""
-        return self._sql_get.first(uri=uri)
+        blob = idmap_get(uri)
+        if blob is None:
+            blob = self._sql_get.first(uri=uri)
+            if blob is not None:
+                idmap_add(blob)
+        return blob
+
+    get.__node_resolver__ = True
 
     def getByParent(self, parent):
         return self._sql_get_by_parent.first(parent=parent)
 
-    def replace(self, uri, data, **metadata): # pragma: no cover
-        pass
+    def listByParent(self, parent, chunksize=500):
+        """ Metadata of all blobs of parent or sequence of parents.
+        Blob objects and data are not loaded, metadata is selected with
+        one query per `chunksize` parents. Returns list of dictionaries
+        with `__uri__`, `__parent_uri__`, `filename`, `mimetype`, `size`,
+        `hash` and `modified` keys. """
+        if isinstance(parent, string_types):
+            parent = (parent,)
+        parents = list(parent)
 
-    def remove(self, uri): # pragma: no cover
-        pass
+        nodes = Node.__table__
+        blobs = Blob.__table__
+        columns = (nodes.c.uri, nodes.c.parent, blobs.c.filename,
+                   blobs.c.mimetype, blobs.c.size, blobs.c.hash,
+                   blobs.c.modified)
+        keys = ('__uri__', '__parent_uri__', 'filename',
+                'mimetype', 'size', 'hash', 'modified')
+
+        Session = ptah.get_session()
+        result = []
+        for idx in range(0, len(parents), chunksize):
+            result.extend(
+                dict(zip(keys, row)) for row in Session.execute(
+                    sqla.sql.select(
+                        columns, sqla.sql.and_(
+                            nodes.c.id == blobs.c.id,
+                            nodes.c.parent.in_(parents[idx:idx+chunksize])))
+                    .order_by(nodes.c.id)))
+
+        return result
+
+    def replace(self, uri, data, **metadata):
+        """ Replace data of existing blob, previous data is not loaded """
+        blob = self.get(uri)
+        if blob is None:
+            raise NotFound(uri)
+
+        data.seek(0)
+        blob.write(data)
+        blob.updateMetadata(**metadata)
+
+        return blob
+
+    def remove(self, uri):
+        """ Remove blob, data payload is released """
+        blob = self.get(uri)
+        if blob is None:
+            raise NotFound(uri)
+
+        Session = ptah.get_session()
+        Session.delete(blob)
+        Session.flush()
+
+        get_current_registry().notify(ptah.events.UriInvalidateEvent(uri))
 
 
 blob_storage = BlobStorage()
 
+
+class PayloadWriter(object):
+    """ Writer of new payload, data is stored by chunks of `chunksize`
+    bytes as soon as chunk is filled. In deduplication mode data is
+    hashed and spooled to temporary file, chunks are stored on close
+    only if there is no payload with same data.
+
+    :param conn: Sqlalchemy session or connection
+    """
+
+    spoolsize = 1048576
+
+    def __init__(self, conn, chunksize, dedup=False):
+        self.conn = conn
+        self.chunksize = chunksize
+        self.id = self.spool = None
+        if dedup:
+            self.spool = tempfile.SpooledTemporaryFile(self.spoolsize)
+        else:
+            self._create()
+
+        self.sha = hashlib.sha256()
+        self.size = self.seq = 0
+        self.buf = binary_type()
+        self.start = self.tail = None
+
+    @classmethod
+    def reopen(cls, conn, id, chunksize, size):
+        """ Writer which appends data to existing payload of `size` bytes,
+        only last incomplete chunk is rewritten. Hash of appended payload
+        is not computed. """
+        chunks = BlobChunk.__table__
+
+        writer = cls.__new__(cls)
+        writer.conn = conn
+        writer.id = id
+        writer.chunksize = chunksize
+        writer.spool = writer.sha = None
+        writer.seq = writer.start = size // chunksize
+        writer.size = writer.seq * chunksize
+        writer.buf = binary_type()
+        writer.tail = None
+
+        if size % chunksize:
+            last = sqla.sql.and_(chunks.c.payload_id == id,
+                                 chunks.c.seq == writer.seq)
+            writer.buf = writer.tail = conn.execute(
+                sqla.sql.select([chunks.c.data], last)).scalar()
+            conn.execute(chunks.delete().where(last))
+
+        return writer
+
+    def _create(self):
+        self.id = self.conn.execute(
+            BlobPayload.__table__.insert(),
+            {'size': 0, 'chunksize': self.chunksize, 'refs': 1}
+        ).inserted_primary_key[0]
+
+    def _write_chunk(self, chunk):
+        self.conn.execute(
+            BlobChunk.__table__.insert(),
+            {'payload_id': self.id, 'seq': self.seq, 'data': chunk})
+        self.size += len(chunk)
+        self.seq += 1
+
+    def _store(self, data):
+        if self.buf:
+            data = self.buf + data
+
+        pos, chunksize = 0, self.chunksize
+        while len(data) - pos >= chunksize:
+            self._write_chunk(data[pos:pos+chunksize])
+            pos += chunksize
+
+        self.buf = data[pos:]
+
+    def write(self, data):
+        if self.sha is not None:
+            self.sha.update(data)
+
+        if self.spool is not None:
+            self.spool.write(data)
+        else:
+            self._store(data)
+
+    def close(self):
+        """ Write rest of data. In deduplication mode existing payload with
+        same data is used instead of new one. Returns payload id, size,
+        hash and chunk size. """
+        hash = self.sha.hexdigest() if self.sha is not None else None
+
+        if self.spool is not None:
+            spool, self.spool = self.spool, None
+            try:
+                found = find_payload(self.conn, hash, spool.tell())
+                if found is not None:
+                    return found
+
+                self._create()
+                spool.seek(0)
+                while True:
+                    data = spool.read(self.chunksize)
+                    if not data:
+                        break
+                    self._store(data)
+            finally:
+                spool.close()
+
+        if self.buf:
+            self._write_chunk(self.buf)
+            self.buf = binary_type()
+
+        payloads = BlobPayload.__table__
+        self.conn.execute(payloads.update().where(payloads.c.id == self.id)
+                          .values(size=self.size, hash=hash))
+        return self.id, self.size, hash, self.chunksize
+
+    def abort(self):
+        """ Remove written data, appended payload is restored """
+        chunks = BlobChunk.__table__
+        payloads = BlobPayload.__table__
+
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+        if self.id is None:
+            return
+
+        if self.start is not None:
+            self.conn.execute(chunks.delete().where(sqla.sql.and_(
+                chunks.c.payload_id == self.id, chunks.c.seq >= self.start)))
+            if self.tail is not None:
+                self.conn.execute(
+                    chunks.insert(),
+                    {'payload_id': self.id, 'seq': self.start,
+                     'data': self.tail})
+            return
+
+        self.conn.execute(
+            chunks.delete().where(chunks.c.payload_id == self.id))
+        self.conn.execute(
+            payloads.delete().where(payloads.c.id == self.id))
+
+
+def find_payload(conn, hash, size):
+    """ Reference existing payload with `hash` and `size`, reference
+    counter of found payload is increased. Returns payload id, size,
+    hash and chunk size or None.
+
+    :param conn: Sqlalchemy session or connection
+    """
+    payloads = BlobPayload.__table__
+    for id, chunksize in conn.execute(
+        sqla.sql.select([payloads.c.id, payloads.c.chunksize],
+                        sqla.sql.and_(payloads.c.hash == hash,
+                                      payloads.c.size == size,
+                                      payloads.c.refs > 0))
+        ).fetchall():
+        # payload could be released by concurrent transaction
+        if conn.execute(
+            payloads.update()
+            .where(sqla.sql.and_(payloads.c.id == id, payloads.c.refs > 0))
+            .values(refs=payloads.c.refs + 1)).rowcount:
+            return id, size, hash, chunksize
+
+    return None
+
+
+def write_payload(conn, data, chunksize, dedup=False):
+    """ Store data of file-like object as new payload. In deduplication
+    mode existing payload with same data is reused. Returns payload id,
+    size, hash and chunk size.
+
+    :param conn: Sqlalchemy session or connection
+    """
+    writer = PayloadWriter(conn, chunksize, dedup)
+    while True:
+        chunk = data.read(chunksize)
+        if not chunk:
+            break
+        writer.write(chunk)
+
+    return writer.close()
+
+
+def payload_refs(conn, id):
+    """ Reference counter of payload """
+    payloads = BlobPayload.__table__
+    return conn.execute(
+        sqla.sql.select([payloads.c.refs], payloads.c.id == id)).scalar()
+
+
+def release_payload(conn, id):
+    """ Decrease reference counter of payload, payload without
+    references is removed.
+
+    :param conn: Sqlalchemy session or connection
+    """
+    release_payloads(conn, (id,))
+
+
+def release_payloads(conn, ids):
+    """ Decrease reference counters of payloads, counter is decreased
+    by number of occurrences of payload id in `ids`. Payloads without
+    references are removed.
+
+    :param conn: Sqlalchemy session or connection
+    """
+    payloads = BlobPayload.__table__
+    chunks = BlobChunk.__table__
+
+    counts = {}
+    for id in ids:
+        counts[id] = counts.get(id, 0) + 1
+    if not counts:
+        return
+
+    for id, count in counts.items():
+        conn.execute(payloads.update().where(payloads.c.id == id)
+                     .values(refs=payloads.c.refs - count))
+
+    orphans = [id for id, in conn.execute(
+        sqla.sql.select([payloads.c.id],
+                        sqla.sql.and_(payloads.c.id.in_(list(counts)),
+                                      payloads.c.refs <= 0)))]
+    if orphans:
+        conn.execute(chunks.delete().where(chunks.c.payload_id.in_(orphans)))
+        conn.execute(payloads.delete().where(payloads.c.id.in_(orphans)))
+
+
+def blob_payloads(conn, ids):
+    """ Payload ids of chunked blobs with node `ids`, payload id is
+    repeated for every blob which references it.
+
+    :param conn: Sqlalchemy session or connection
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+
+    blobs = Blob.__table__
+    return [id for id, in conn.execute(
+        sqla.sql.select([blobs.c.payload],
+                        sqla.sql.and_(blobs.c.id.in_(ids),
+                                      blobs.c.chunksize > 0,
+                                      blobs.c.payload != None)))]
+
+
+def gc_payloads(chunksize=500):
+    """ Remove payloads which are not referenced by any blob and fix
+    reference counters. Blobs deleted with sql statements outside of
+    ptahcms don't release their payloads. Returns number of removed
+    payloads. """
+    payloads = BlobPayload.__table__
+    chunks = BlobChunk.__table__
+    blobs = Blob.__table__
+
+    Session = ptah.get_session()
+    Session.flush()
+
+    Session.execute(payloads.update().values(
+        refs=sqla.sql.select([sqla.func.count(blobs.c.id)],
+                             blobs.c.payload == payloads.c.id).as_scalar()))
+
+    orphans = [id for id, in Session.execute(
+        sqla.sql.select([payloads.c.id], payloads.c.refs <= 0))]
+
+    for idx in range(0, len(orphans), chunksize):
+        ids = orphans[idx:idx+chunksize]
+        Session.execute(chunks.delete().where(chunks.c.payload_id.in_(ids)))
+        Session.execute(payloads.delete().where(payloads.c.id.in_(ids)))
+
+    return len(orphans)
+
+
+def blob_before_delete(mapper, connection, blob):
+    """ Release data payload of deleted blob """
+    if blob.chunksize and blob.payload_id:
+        connection.execute(Blob.__table__.update()
+                           .where(Blob.__table__.c.id == blob.__id__)
+                           .values(payload=None))
+        release_payload(connection, blob.payload_id)
+
+sqla.event.listen(Blob, 'before_delete', blob_before_delete, propagate=True)
+
 ptah.resolver.register('blob-sql', blob_storage.get)
@@ -0,0 +1,303 @@
+""" filesystem blob storage implementation """
+import os
+import shutil
+import weakref
+import hashlib
+import tempfile
+import transaction
+import sqlalchemy as sqla
+from io import BytesIO
+from datetime import datetime
+from pyramid.compat import binary_type
+from zope.interface import implementer
+
+import ptah
+from ptahcms.blob import Blob, BlobWriter, BlobStorage
+from ptahcms.node import node_query, idmap_get, idmap_add
+from ptahcms.settings import CFG_ID_CMS
+from ptahcms.interfaces import Error, IFSBlob
+
+BLOCK_SIZE = 65536
+
+
+@implementer(IFSBlob)
+class FSBlob(Blob):
+    """ blob with data stored in file system, only metadata is
+    stored in `ptahcms_blobs` table. Files are stored in
+    `ptahcms.blob_fs_path` directory tree sharded by first
+    characters of blob id. """
+
+    __mapper_args__ = {'polymorphic_identity': 'blob-fs'}
+    __uri_factory__ = ptah.UriFactory('blob-fs')
+
+    @property
+    def path(self):
+        return blob_path(self.__uri__)
+
+    def _files(self):
+        return [path for path in current_paths(self.path)
+                if os.path.exists(path)]
+
+    def open(self):
+        """ Open blob file for reading, data written in current
+        transaction is visible """
+        files = self._files()
+        if not files:
+            return BytesIO(binary_type())
+        if len(files) > 1:
+            return BytesIO(self.read())
+        return open(files[0], 'rb')
+
+    def read(self):
+        if not self._files():
+            return None
+
+        return binary_type().join(self.iterdata())
+
+    def iterdata(self, start=0, stop=None):
+        offset = 0
+        for path in self._files():
+            if stop is not None and offset >= stop:
+                break
+
+            size = os.path.getsize(path)
+            if offset + size > start:
+                with open(path, 'rb') as f:
+                    pos = max(start - offset, 0)
+                    f.seek(pos)
+                    left = None if stop is None else stop - offset - pos
+                    while left is None or left > 0:
+                        data = f.read(BLOCK_SIZE if left is None
+                                      else min(BLOCK_SIZE, left))
+                        if not data:
+                            break
+                        if left is not None:
+                            left -= len(data)
+                        yield data
+
+            offset += size
+
+    def writer(self, append=False):
+        """ Streaming writer of blob data, see :py:class:`FSBlobWriter` """
+        return FSBlobWriter(self, append)
+
+
+def blob_path(uri):
+    """ Path of blob file in `ptahcms.blob_fs_path` directory """
+    root = ptah.get_settings(CFG_ID_CMS)['blob_fs_path']
+    if not root:
+        raise Error("Blob storage path is not configured")
+
+    id = uri.split(':', 1)[1]
+    return os.path.join(root, id[:2], id[2:4], id)
+
+
+class BlobFiles(object):
+    """ Transaction data manager of blob files. Written data is staged
+    in temporary files which replace blob files when transaction is
+    committed, appended data is added to blob files and files of deleted
+    blobs are removed after commit. On abort staged files are removed
+    and blob files are not changed. """
+
+    def __init__(self, manager):
+        self.transaction_manager = manager
+        self.files = {}
+        self.appends = {}
+
+    def paths(self, path):
+        """ Files with data of blob file `path` in current transaction """
+        if path in self.files:
+            tmp = self.files[path]
+            return [] if tmp is None else [tmp]
+        if path in self.appends:
+            return [path, self.appends[path]]
+        return [path]
+
+    def stage(self, path, tmp):
+        self._discard(path)
+        self.files[path] = tmp
+
+    def append(self, path, tmp):
+        """ Append data of `tmp` file to blob file, data is added to
+        staged file of blob if there is one """
+        staged = self.files.get(path, self.appends.get(path))
+        if staged is None:
+            if path in self.files:
+                self.files[path] = tmp
+            else:
+                self.appends[path] = tmp
+            return
+
+        append_file(tmp, staged)
+        os.remove(tmp)
+
+    def remove(self, path):
+        self._discard(path)
+        self.files[path] = None
+
+    def _discard(self, path):
+        for tmp in (self.files.pop(path, None), self.appends.pop(path, None)):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+    def abort(self, txn):
+        for path in set(self.files) | set(self.appends):
+            self._discard(path)
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        for path, tmp in self.files.items():
+            if tmp is not None:
+                os.rename(tmp, path)
+            elif os.path.exists(path):
+                os.remove(path)
+        self.files.clear()
+
+        for path, tmp in self.appends.items():
+            append_file(tmp, path)
+            os.remove(tmp)
+        self.appends.clear()
+
+    def tpc_abort(self, txn):
+        self.abort(txn)
+
+    def sortKey(self):
+        return '~ptahcms-blobfs:%d' % id(self)
+
+
+_blob_files = weakref.WeakKeyDictionary()
+
+def blob_files():
+    """ :py:class:`BlobFiles` data manager of current transaction """
+    txn = transaction.get()
+    files = _blob_files.get(txn)
+    if files is None:
+        files = _blob_files[txn] = BlobFiles(transaction.manager)
+        txn.join(files)
+    return files
+
+
+def current_paths(path):
+    """ Files with data of blob file `path` in current transaction """
+    files = _blob_files.get(transaction.get())
+    if files is None:
+        return [path]
+    return files.paths(path)
+
+
+def append_file(src, path):
+    """ Append data of file `src` to file `path` """
+    with open(src, 'rb') as f:
+        with open(path, 'ab') as out:
+            shutil.copyfileobj(f, out, BLOCK_SIZE)
+
+
+def remove_blob_files(uris):
+    """ Remove files of blobs `uris` after commit, nothing is removed
+    if `ptahcms.blob_fs_path` is not configured """
+    if not ptah.get_settings(CFG_ID_CMS)['blob_fs_path']:
+        return
+
+    files = blob_files()
+    for uri in uris:
+        files.remove(blob_path(uri))
+
+
+class FSBlobWriter(BlobWriter):
+    """ Streaming writer of file system blob. Data is written to temporary
+    file which replaces blob file when transaction is committed. In append
+    mode only new data is written, it is added to blob file on commit and
+    hash of data is not computed. """
+
+    blocksize = BLOCK_SIZE
+
+    def __init__(self, blob, append=False):
+        self.blob = blob
+        self.path = blob.path
+
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        fd, self.tmp = tempfile.mkstemp(dir=dirname)
+        self.file = os.fdopen(fd, 'wb')
+        self.append = append
+        self.sha = None if append else hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.file.write(data)
+        if self.sha is not None:
+            self.sha.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+
+        blob = self.blob
+        if self.append:
+            blob_files().append(self.path, self.tmp)
+            blob.size = (blob.size or 0) + self.size
+            blob.hash = None
+        else:
+            blob_files().stage(self.path, self.tmp)
+            blob.size = self.size
+            blob.hash = self.sha.hexdigest()
+
+        blob.chunksize = 0
+        blob.modified = datetime.utcnow()
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp)
+
+
+def fsblob_after_delete(mapper, connection, blob):
+    """ Remove blob file after successful commit """
+    remove_blob_files((blob.__uri__,))
+
+sqla.event.listen(FSBlob, 'after_delete', fsblob_after_delete)
+
+
+class FSBlobStorage(BlobStorage):
+    """ file system blob storage """
+
+    _sql_get = ptah.QueryFreezer(
+        lambda: node_query(FSBlob)
+            .filter(FSBlob.__uri__ == sqla.sql.bindparam('uri')))
+
+    _sql_get_by_parent = ptah.QueryFreezer(
+        lambda: node_query(FSBlob)
+            .filter(FSBlob.__parent_uri__ == sqla.sql.bindparam('parent')))
+
+    def create(self, parent=None):
+        blob = FSBlob(__parent__=parent)
+        Session = ptah.get_session()
+        Session.add(blob)
+        Session.flush()
+
+        return blob
+
+    def get(self, uri):
+        """File system blob resolver"""
+        blob = idmap_get(uri)
+        if blob is None:
+            blob = self._sql_get.first(uri=uri)
+            if blob is not None:
+                idmap_add(blob)
+        return blob
+
+    get.__node_resolver__ = True
+
+
+blobfs_storage = FSBlobStorage()
+
+ptah.resolver.register('blob-fs', blobfs_storage.get)
@@ -1,28 +1,58 @@
 """ Base container class implementation """
 import sqlalchemy as sqla
+from datetime import datetime
+from collections import OrderedDict
 from zope.interface import implementer
 from pyramid.compat import string_types
 from pyramid.threadlocal import get_current_registry
 
 import ptah
-from ptahcms.node import load_parents
+from ptahcms.node import Node, node_query, load_parents, idmap_add
 from ptahcms.content import Content, BaseContent
-from ptahcms.security import action
+from ptahcms.localroles import permission_clause
+from ptahcms.blob import Blob, blob_payloads, release_payloads
+from ptahcms.blobfs import remove_blob_files
+from ptahcms.security import action, filter_permitted
 from ptahcms.permissions import View, DeleteContent, RenameContent
-from ptahcms.interfaces import IContent, IContainer, NotFound, Error
+from ptahcms.interfaces import IContent, IContainer, IFSBlob
+from ptahcms.interfaces import NotFound, Forbidden, Error
+
+CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+CURSOR_MIN_DATE = datetime(1900, 1, 1)
 
 
 class BaseContainer(BaseContent):
-    """ Content container implementation. """
+    """ Content container implementation.
+
+    .. attribute:: __bulk_delete__
+
+       Delete subtree of container with set-based sql statements,
+       see :py:func:`ptahcms.container.delete_subtree`.
+
+    .. attribute:: __bulk_delete_events__
+
+       Send `ContentDeletingEvent` for every deleted descendant
+       in bulk delete mode.
+    """
+
+    __bulk_delete__ = False
+    __bulk_delete_events__ = False
 
     _sql_keys = ptah.QueryFreezer(
         lambda: ptah.get_session().query(BaseContent.__name_id__)
             .filter(BaseContent.__parent_uri__ == sqla.sql.bindparam('uri')))
 
     _sql_values = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(BaseContent)
+        lambda: node_query(BaseContent)
             .filter(BaseContent.__parent_uri__ == sqla.sql.bindparam('uri')))
 
+    _sql_contains = ptah.QueryFreezer(
+        lambda: ptah.get_session().query(
+            sqla.sql.exists().where(sqla.sql.and_(
+                BaseContent.__table__.c.id == Node.__table__.c.id,
+                Node.__table__.c.parent == sqla.sql.bindparam('parent'),
+                BaseContent.__table__.c.name == sqla.sql.bindparam('key')))))
+
     def keys(self):
         """Return an list of the keys in the container."""
         return [k for k, in self._sql_keys.all(uri=self.__uri__)]
@@ -35,6 +65,7 @@ class BaseContainer(BaseContent):
         item = self._sql_get_in_parent.first(key=key, parent=self.__uri__)
         if item is not None:
             item.__parent__ = self
+            idmap_add(item)
         return item
 
     def values(self):
@@ -46,6 +77,7 @@ class BaseContainer(BaseContent):
             item.__parent__ = self
             values.append(item)
 
+        idmap_add(*values)
         return values
 
     def items(self):
@@ -53,9 +85,131 @@ class BaseContainer(BaseContent):
         for item in self.values():
             yield item.__name__, item
 
+    def _sql_listing(self, order='name', reverse=False, after=None):
+        """ Query for container items ordered by `name`, `created`
+        or `modified`, `after` is a cursor returned by
+        :py:meth:`cursor` """
+        name = BaseContent.__name_id__
+        if order == 'name':
+            key = name
+        elif order in ('created', 'modified'):
+            key = sqla.func.coalesce(
+                getattr(BaseContent, order),
+                sqla.sql.literal(CURSOR_MIN_DATE, sqla.DateTime))
+        else:
+            raise ValueError(order)
+
+        query = ptah.get_session().query(BaseContent)\
+            .filter(BaseContent.__parent_uri__ == self.__uri__)\
+            .options(sqla.orm.lazyload('__children__'))
+
+        if after is not None:
+            if order == 'name':
+                query = query.filter(name < after if reverse else name > after)
+            else:
+                value, after = after.split('/', 1)
+                value = datetime.strptime(value, CURSOR_DATE_FORMAT)
+                if reverse:
+                    query = query.filter(sqla.or_(
+                        key < value, sqla.and_(key == value, name < after)))
+                else:
+                    query = query.filter(sqla.or_(
+                        key > value, sqla.and_(key == value, name > after)))
+
+        if reverse:
+            return query.order_by(key.desc(), name.desc())
+        return query.order_by(key, name)
+
+    def cursor(self, item, order='name'):
+        """ Cursor for keyset pagination, it points to `item` position """
+        if order == 'name':
+            return item.__name__
+
+        value = getattr(item, order, None) or CURSOR_MIN_DATE
+        return '%s/%s'%(value.strftime(CURSOR_DATE_FORMAT), item.__name__)
+
+    def itervalues(self, order='name', reverse=False, after=None,
+                   chunksize=100):
+        """Iterate over values of the container, values are loaded
+        from database lazily by `chunksize` rows."""
+        for item in self._sql_listing(
+            order, reverse, after).yield_per(chunksize):
+            item.__parent__ = self
+            idmap_add(item)
+            yield item
+
+    def _sql_permitted(self, permission, public=False,
+                       order='name', reverse=False, after=None):
+        """ Listing query of container items with `permission`, or
+        `public` items if `public` is True. Returns None if permission
+        can't be checked with sql, see
+        :py:func:`ptahcms.localroles.permission_clause` """
+        clause = permission_clause(self, permission)
+        if clause is None:
+            return None
+
+        if public:
+            clause = sqla.or_(BaseContent.public == True, clause)
+
+        return self._sql_listing(order, reverse, after).filter(clause)
+
+    def page(self, limit, after=None, order='name', reverse=False,
+             permission=None):
+        """Return list of `limit` values of the container which follow
+        `after` cursor and cursor for next page. Next page cursor is
+        None for last page. If `permission` is set, only values with
+        this permission for current principal are returned, permission
+        is checked by sql query."""
+        query = None
+        if permission is not None:
+            query = self._sql_permitted(permission, False, order, reverse, after)
+            if query is None:
+                return self._filtered_page(
+                    limit, after, order, reverse,
+                    lambda items: filter_permitted(items, permission))
+
+        if query is None:
+            query = self._sql_listing(order, reverse, after)
+
+        return self._load_page(query, limit, order)
+
+    def _load_page(self, query, limit, order):
+        values = query.limit(limit+1).all()
+
+        cursor = None
+        if len(values) > limit:
+            values = values[:limit]
+            cursor = self.cursor(values[-1], order)
+
+        for item in values:
+            item.__parent__ = self
+
+        idmap_add(*values)
+        return values, cursor
+
     def __contains__(self, key):
         """Tell if a key exists in the mapping."""
-        return key in self.keys()
+        exists, = self._sql_contains.first(parent=self.__uri__, key=key)
+        return bool(exists)
+
+    def free_name(self, name, suffix=''):
+        """Return `name` with `suffix` if it is not used in the container,
+        otherwise first free `name-N` with `suffix`."""
+        column = BaseContent.__name_id__
+        n = '%s%s'%(name, suffix)
+
+        used = set(
+            key for key, in ptah.get_session().query(column)
+            .filter(BaseContent.__parent_uri__ == self.__uri__)
+            .filter(sqla.sql.or_(column == n,
+                                 path_prefix(column, '%s-'%name))))
+
+        i = 0
+        while n in used:
+            i += 1
+            n = '%s-%s%s'%(name, i, suffix)
+
+        return n
 
     def __getitem__(self, key):
         """Get a value for a key
@@ -65,6 +219,7 @@ class BaseContainer(BaseContent):
         try:
             item = self._sql_get_in_parent.one(key=key, parent=self.__uri__)
             item.__parent__ = self
+            idmap_add(item)
 
             return item
         except sqla.orm.exc.NoResultFound:
@@ -83,7 +238,7 @@ class BaseContainer(BaseContent):
         if item.__uri__ in parents:
             raise TypeError("Can't itself to chidlren")
 
-        if key in self.keys():
+        if key in self:
             raise KeyError(key)
 
         if item.__parent_uri__ is None:
@@ -91,6 +246,8 @@ class BaseContainer(BaseContent):
         else:
             event = ptah.events.ContentMovedEvent(item)
 
+        old_path = item.__path__
+
         item.__name__ = key
         item.__parent__ = self
         item.__parent_uri__ = self.__uri__
@@ -110,17 +267,30 @@ class BaseContainer(BaseContent):
                     update_path(item)
 
         if isinstance(item, BaseContainer):
-            update_path(item)
+            if old_path and old_path.startswith('/'):
+                Session.flush()
+                rewrite_paths(old_path, item.__path__)
+            else:
+                update_path(item)
 
         get_current_registry().notify(event)
 
     def __delitem__(self, item, flush=True):
-        """Delete a value from the container using the key."""
+        """Delete a value from the container using the key. `flush` is
+        ignored for containers in bulk delete mode, set-based statements
+        are executed immediately after flush of pending changes."""
 
         if isinstance(item, string_types):
             item = self[item]
 
         if item.__parent_uri__ == self.__uri__:
+            if isinstance(item, BaseContainer) and item.__bulk_delete__:
+                get_current_registry().notify(
+                    ptah.events.ContentDeletingEvent(item))
+
+                delete_subtree(item, item.__bulk_delete_events__)
+                return
+
             if isinstance(item, BaseContainer):
                 for key in item.keys():
                     item.__delitem__(key, False)
@@ -170,21 +340,102 @@ class BaseContainer(BaseContent):
         return item
 
     @action(permission=DeleteContent)
-    def batchdelete(self, uris):
-        """Batch delete"""
-        raise NotImplements() # pragma: no cover
+    def batchdelete(self, uris, chunksize=500):
+        """Batch delete. Delete content items of container and their
+        subtrees. Current principal has to have `DeleteContent` permission
+        for all items, otherwise nothing is deleted. Containers with
+        `__bulk_delete__` are deleted with set-based statements, see
+        :py:func:`delete_subtrees`, other items are deleted same way as
+        with `__delitem__`.
+
+        :param uris: Sequence of uris of container items
+        :raise NotFound: Uri is not found or is not item of this container.
+        :raise Forbidden: Permission check failed for one of items.
+        """
+        uris = list(OrderedDict.fromkeys(uris))
+
+        items = {}
+        Session = ptah.get_session()
+        for idx in range(0, len(uris), chunksize):
+            for item in Session.query(BaseContent).filter(
+                BaseContent.__uri__.in_(uris[idx:idx+chunksize])):
+                items[item.__uri__] = item
+
+        for uri in uris:
+            item = items.get(uri)
+            if item is None or item.__parent_uri__ != self.__uri__:
+                raise NotFound(uri)
+
+            item.__parent__ = self
+
+        items = [items[uri] for uri in uris]
+
+        permitted = filter_permitted(items, DeleteContent)
+        if len(permitted) != len(items):
+            permitted = set(id(item) for item in permitted)
+            for item in items:
+                if id(item) not in permitted:
+                    raise Forbidden(item.__uri__)
+
+        # containers in bulk delete mode are deleted with set-based
+        # statements, grouped by `__bulk_delete_events__`, other items
+        # same way as with `__delitem__`
+        bulk = {}
+        registry = get_current_registry()
+        for item in items:
+            if isinstance(item, BaseContainer) and item.__bulk_delete__:
+                registry.notify(ptah.events.ContentDeletingEvent(item))
+                bulk.setdefault(
+                    bool(item.__bulk_delete_events__), []).append(item)
+            else:
+                self.__delitem__(item, False)
+
+        Session.flush()
+
+        for events, bulk_items in sorted(bulk.items()):
+            delete_subtrees(bulk_items, events, chunksize)
+
+        return uris
 
     def contents(self):
         """ Returns public or viewable content of the container """
 
-        contents = []
-        
-        for content in self.values():
-            if IContent.providedBy(content):
-                if content.public or ptah.check_permission(View, content):
-                    contents.append(content)
+        return viewable(self.values())
+
+    def contents_page(self, limit, after=None, order='name', reverse=False):
+        """ Returns public or viewable content of one page of
+        the container and cursor for next page, see :py:meth:`page` """
+        query = self._sql_permitted(View, True, order, reverse, after)
+        if query is None:
+            return self._filtered_page(limit, after, order, reverse, viewable)
+
+        values, cursor = self._load_page(query, limit, order)
+        return [v for v in values if IContent.providedBy(v)], cursor
+
+    def contents_count(self):
+        """ Number of public or viewable content items of the container """
+        query = self._sql_permitted(View, True)
+        if query is None:
+            return len(self.contents())
+
+        return query.order_by(None).count()
 
-        return contents
+    def _filtered_page(self, limit, after, order, reverse, filter):
+        """ Page of values filtered by python `filter` function,
+        values are loaded until page is full """
+        values = []
+        cursor = after
+        while len(values) < limit:
+            chunk, cursor = self.page(limit, cursor, order, reverse)
+            values.extend(filter(chunk))
+            if cursor is None:
+                break
+
+        if len(values) > limit:
+            values = values[:limit]
+            cursor = self.cursor(values[-1], order)
+
+        return values, cursor
 
     def info(self):
         info = super(BaseContainer, self).info()
@@ -192,6 +443,186 @@ class BaseContainer(BaseContent):
         return info
 
 
+def path_prefix(column, path):
+    """ `LIKE` clause for all values of column which start with `path` """
+    escaped = path.replace(
+        '\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    return column.like('%s%%'%escaped, escape='\\')
+
+
+def rewrite_paths(old, new):
+    """ Replace `old` prefix of `__path__` with `new` for all content
+    in subtree with one sql statement. Content objects already loaded into
+    session are updated without additional queries. """
+    Session = ptah.get_session()
+    table = BaseContent.__table__
+
+    Session.execute(
+        table.update()
+            .where(path_prefix(table.c.path, old))
+            .values(path=sqla.sql.literal(new, sqla.Unicode) +
+                    sqla.func.substr(table.c.path, len(old)+1)))
+
+    l_old = len(old)
+    for item in list(Session.identity_map.values()):
+        if isinstance(item, BaseContent):
+            path = item.__dict__.get('__path__')
+            if path and path.startswith(old):
+                sqla.orm.attributes.set_committed_value(
+                    item, '__path__', '%s%s'%(new, path[l_old:]))
+
+
+def cascade_columns(column):
+    """ Columns with `ON DELETE CASCADE` foreign key to `column`.
+    Set-based delete removes dependent rows explicitly, not all
+    databases enforce foreign keys. """
+    return [fk.parent for table in column.table.metadata.tables.values()
+            for fk in table.foreign_keys
+            if fk.column is column and
+            (fk.ondelete or '').upper() == 'CASCADE']
+
+
+def delete_subtree(item, events=False, chunksize=500):
+    """ Delete content `item` and all its descendants with set-based sql
+    statements. Subtree is found with one path prefix query, rows are
+    deleted in chunks from all polymorphic tables, deepest nodes first.
+
+    :param item: :py:class:`ptahcms.BaseContent` object
+    :param events: Send `ContentDeletingEvent` for every descendant, this
+        requires loading of descendants. Otherwise only
+        `UriInvalidateEvent` is sent for every deleted uri.
+    :param chunksize: Number of nodes deleted with one statement.
+    """
+    delete_subtrees((item,), events, chunksize)
+
+
+def delete_subtrees(items, events=False, chunksize=500):
+    """ Same as :py:func:`delete_subtree` but for sequence of content
+    items. Events are not sent for `items` themselves. """
+    for item in items:
+        if not item.__path__:
+            raise Error("Can't find content path")
+
+    Session = ptah.get_session()
+    Session.flush()
+
+    nodes = Node.__table__
+    contents = BaseContent.__table__
+    polymorphic_map = sqla.orm.class_mapper(Node).polymorphic_map
+
+    # subtree content, depth is based on path
+    subtree = {}
+    for idx in range(0, len(items), chunksize):
+        prefixes = [path_prefix(contents.c.path, item.__path__)
+                    for item in items[idx:idx+chunksize]]
+
+        for id, uri, type, path in Session.execute(
+            sqla.select([nodes.c.id, nodes.c.uri,
+                         nodes.c.type, contents.c.path],
+                        sqla.and_(nodes.c.id == contents.c.id,
+                                  sqla.or_(*prefixes)))):
+            subtree[uri] = (path.count('/'), id,
+                            polymorphic_map.get(type, BaseContent.__mapper__))
+
+    # non content child nodes, blobs for example
+    parents = [(uri, info[0]) for uri, info in subtree.items()]
+    while parents:
+        found = []
+        for idx in range(0, len(parents), chunksize):
+            chunk = dict(parents[idx:idx+chunksize])
+            for id, uri, type, parent in Session.execute(
+                sqla.select([nodes.c.id, nodes.c.uri,
+                             nodes.c.type, nodes.c.parent],
+                            nodes.c.parent.in_(list(chunk.keys())))):
+                if uri not in subtree:
+                    depth = chunk[parent] + 1
+                    subtree[uri] = (depth, id,
+                                    polymorphic_map.get(type, Node.__mapper__))
+                    found.append((uri, depth))
+        parents = found
+
+    registry = get_current_registry()
+    records = sorted(((depth, id, uri, mapper)
+                      for uri, (depth, id, mapper) in subtree.items()),
+                     key=lambda r: r[0], reverse=True)
+
+    notified = set(item.__uri__ for item in items)
+    for idx in range(0, len(records), chunksize):
+        chunk = records[idx:idx+chunksize]
+
+        if events:
+            for content in Session.query(BaseContent).filter(
+                BaseContent.__id__.in_([id for _d, id, _u, _m in chunk])):
+                if content.__uri__ not in notified:
+                    notified.add(content.__uri__)
+                    registry.notify(
+                        ptah.events.ContentDeletingEvent(content))
+
+        for _d, _id, uri, _m in chunk:
+            if uri not in notified:
+                registry.notify(ptah.events.UriInvalidateEvent(uri))
+
+        # rows from all polymorphic tables, most specific tables first
+        tables = {}
+        for _d, id, _u, mapper in chunk:
+            hierarchy = []
+            while mapper is not None:
+                if mapper.local_table not in hierarchy:
+                    hierarchy.insert(0, mapper.local_table)
+                mapper = mapper.inherits
+
+            for level, table in enumerate(hierarchy):
+                tables.setdefault(table, (level, set()))[1].add(id)
+
+        # files of file system blobs are removed after commit
+        files = [uri for _d, _id, uri, mapper in chunk
+                 if IFSBlob.implementedBy(mapper.class_)]
+        if files:
+            remove_blob_files(files)
+
+        # payloads of chunked blobs are released after blobs are deleted
+        payloads = blob_payloads(
+            Session, [id for _d, id, _u, mapper in chunk
+                      if issubclass(mapper.class_, Blob)])
+
+        uris = [uri for _d, _id, uri, _m in chunk]
+        for column in cascade_columns(nodes.c.uri):
+            Session.execute(column.table.delete().where(column.in_(uris)))
+
+        for table, (level, ids) in sorted(
+            tables.items(), key=lambda t: t[1][0], reverse=True):
+            pk = list(table.primary_key)[0]
+            for column in cascade_columns(pk):
+                Session.execute(
+                    column.table.delete().where(column.in_(list(ids))))
+            Session.execute(table.delete().where(pk.in_(list(ids))))
+
+        release_payloads(Session, payloads)
+
+    # sync session
+    for obj in list(Session.identity_map.values()):
+        if isinstance(obj, Node) and obj.__dict__.get('__uri__') in subtree \
+                and obj in Session:
+            Session.expunge(obj)
+
+    for obj in list(Session.identity_map.values()):
+        children = obj.__dict__.get('__children__')
+        if children and [c for c in children if c.__uri__ in subtree]:
+            Session.expire(obj, ['__children__'])
+
+
+def viewable(items):
+    """ Public or viewable content items, see
+    :py:func:`ptahcms.security.filter_permitted` """
+    items = [item for item in items if IContent.providedBy(item)]
+
+    permitted = set(id(item) for item in filter_permitted(
+        [item for item in items if not item.public], View))
+
+    return [item for item in items if item.public or id(item) in permitted]
+
+
 @implementer(IContainer)
 class Container(BaseContainer, Content):
     """ container for content, it just for inheritance """
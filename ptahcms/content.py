@@ -7,7 +7,7 @@ from pyramid.compat import text_type
 from pyramid.threadlocal import get_current_registry
 
 import ptah
-from ptahcms.node import Node
+from ptahcms.node import Node, node_query, idmap_add
 from ptahcms.interfaces import Error, IContent
 from ptahcms.security import action
 from ptahcms.permissions import DeleteContent, ModifyContent, RenameContent
@@ -73,7 +73,8 @@ class BaseContent(Node):
                          sqla.ForeignKey('ptahcms_nodes.id'), primary_key=True)
     __path__ = sqla.Column('path', sqla.Unicode(1024),
                            default=text_type(''), index=True)
-    __name_id__ = sqla.Column('name', sqla.Unicode(255), default=text_type(''))
+    __name_id__ = sqla.Column('name', sqla.Unicode(255),
+                              default=text_type(''), index=True)
 
     title = sqla.Column(sqla.Unicode(1024), default=text_type(''),
                         info={'title': _('Title')})
@@ -95,18 +96,20 @@ class BaseContent(Node):
 
     # sql queries
     _sql_get = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(BaseContent)
+        lambda: node_query(BaseContent)
         .filter(BaseContent.__uri__ == sqla.sql.bindparam('uri')))
 
     _sql_get_in_parent = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(BaseContent)
+        lambda: node_query(BaseContent)
             .filter(BaseContent.__name_id__ == sqla.sql.bindparam('key'))
             .filter(BaseContent.__parent_uri__ == sqla.sql.bindparam('parent')))
 
     _sql_parent = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(BaseContent)
+        lambda: node_query(BaseContent, lean=True)
             .filter(BaseContent.__uri__ == sqla.sql.bindparam('parent')))
 
+    _sql_ancestors_by_path = {}
+
     def __init__(self, **kw):
         super(BaseContent, self).__init__(**kw)
 
@@ -124,6 +127,29 @@ class BaseContent(Node):
     def __resource_url__(self, request, info):
         return self.__path__
 
+    def _load_ancestors(self, queries=_sql_ancestors_by_path):
+        """ Load parents of content by prefixes of `__path__` """
+        path = self.__path__
+        if not path or not self.__parent_uri__:
+            return super(BaseContent, self)._load_ancestors()
+
+        paths = {'0': '/'}
+        current = '/'
+        for sec in path.split('/')[1:-2]:
+            current = '%s%s/'%(current, sec)
+            paths[str(len(paths))] = current
+
+        idx = len(paths)
+        if idx not in queries:
+            bindparams = [sqla.sql.bindparam(str(p)) for p in range(idx)]
+
+            queries[idx] = ptah.QueryFreezer(
+                lambda: node_query(BaseContent, lean=True)\
+                    .filter(BaseContent.__path__.in_(bindparams)))
+
+        return dict((p.__uri__, p) for p in
+                    idmap_add(*queries[idx].all(**paths)))
+
     @action(permission=DeleteContent)
     def delete(self):
         parent = self.__parent__
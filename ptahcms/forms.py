@@ -55,12 +55,7 @@ class AddForm(form.Form):
             re.sub('^\w-|-\w-|-\w$', '-',
                    re.sub(r'\W', '-', name.strip()))).strip('-').lower()
 
-        suffix = self.name_suffix
-        n = '%s%s'%(name, suffix)
-        i = 0
-        while n in self.container:
-            i += 1
-            n = '%s-%s%s'%(name, i, suffix)
+        n = self.container.free_name(name, self.name_suffix)
 
         return n.replace('/', '-').lstrip('+@')
 
@@ -80,7 +75,7 @@ class AddForm(form.Form):
 
         if self.name_show and '__name__' in data and data['__name__']:
             name = data['__name__']
-            if name in self.container.keys():
+            if name in self.container:
                 error = form.Invalid(_('Name already in use'))
                 error.field = self.widgets['__name__']
                 errors.append(error)
@@ -186,7 +181,7 @@ class RenameForm(form.Form):
 
         name = data['__name__']
         if name != self.context.__name__:
-            if self.container and name in self.container.keys():
+            if self.container is not None and name in self.container:
                 error = form.Invalid(_('Name already in use'))
                 error.field = self.widgets['__name__']
                 errors.append(error)
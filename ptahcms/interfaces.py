@@ -55,8 +55,32 @@ class IBlob(INode):
 
     mimetype = interface.Attribute('Blob mimetype')
     filename = interface.Attribute('Original filename')
+    size = interface.Attribute('Data size')
+    hash = interface.Attribute('Data sha256 hex digest')
+    modified = interface.Attribute('Time of last data write')
     data = interface.Attribute('Blob data')
 
+    def read():
+        """ return blob data """
+
+    def iterdata(start=0, stop=None):
+        """ iterate over chunks of blob data from start to stop byte """
+
+    def write(data):
+        """ write blob data, data is bytes or file-like object """
+
+    def writer(append=False):
+        """ return streaming writer of blob data """
+
+
+class IFSBlob(IBlob):
+    """ blob stored in file system """
+
+    path = interface.Attribute('Path of blob file')
+
+    def open():
+        """ open blob file for reading """
+
 
 class IBlobStorage(interface.Interface):
     """ blob storage """
@@ -67,6 +91,9 @@ class IBlobStorage(interface.Interface):
     def query(uri):
         """ return blob object """
 
+    def listByParent(parent):
+        """ return metadata of all blobs of parent or sequence of parents """
+
     def replace(uri, data, mimetype=None, filename=None):
         """ replace existing blob """
 
@@ -0,0 +1,221 @@
+""" materialized local roles """
+import sqlalchemy as sqla
+from pyramid.security import Allow
+from pyramid.threadlocal import get_current_registry
+
+import ptah
+from ptah.security import ACLsMerge
+from ptahcms.node import Node, _ancestors_cte
+from ptahcms.security import custom_security, roles_providers
+from ptahcms.security import _lineage_security, _permission_entries
+
+
+class LocalRole(ptah.get_base()):
+    """ Local role granted to principal on node. Rows are kept in sync
+    with `Node.__local_roles__` on every flush, node roles are
+    inherited by node descendants. """
+
+    __tablename__ = 'ptahcms_local_roles'
+
+    node = sqla.Column(sqla.String(255),
+                       sqla.ForeignKey('ptahcms_nodes.uri', ondelete='CASCADE'),
+                       primary_key=True)
+    principal = sqla.Column(sqla.String(255), primary_key=True)
+    role = sqla.Column(sqla.String(255), primary_key=True)
+
+    __table_args__ = (
+        sqla.Index('ix_ptahcms_local_roles_principal', 'principal', 'role'),)
+
+
+def local_roles_rows(uri, local_roles):
+    return [{'node': uri, 'principal': principal, 'role': role}
+            for principal, roles in (local_roles or {}).items()
+            for role in sorted(set(roles))]
+
+
+def sync_local_roles(connection, uri, local_roles):
+    """ Replace local roles rows of node `uri` """
+    table = LocalRole.__table__
+    connection.execute(table.delete().where(table.c.node == uri))
+
+    rows = local_roles_rows(uri, local_roles)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def node_after_insert(mapper, connection, node):
+    rows = local_roles_rows(node.__uri__, node.__local_roles__)
+    if rows:
+        connection.execute(LocalRole.__table__.insert(), rows)
+
+
+def node_after_update(mapper, connection, node):
+    if sqla.orm.attributes.get_history(
+            node, '__local_roles__').has_changes():
+        sync_local_roles(connection, node.__uri__, node.__local_roles__)
+
+
+def node_after_delete(mapper, connection, node):
+    table = LocalRole.__table__
+    connection.execute(table.delete().where(table.c.node == node.__uri__))
+
+sqla.event.listen(Node, 'after_insert', node_after_insert, propagate=True)
+sqla.event.listen(Node, 'after_update', node_after_update, propagate=True)
+sqla.event.listen(Node, 'after_delete', node_after_delete, propagate=True)
+
+
+_sql_node_roles = ptah.QueryFreezer(
+    lambda: ptah.get_session().query(LocalRole.role).distinct()
+        .filter(LocalRole.principal == sqla.sql.bindparam('principal'))
+        .filter(LocalRole.node.in_(_ancestors_cte())))
+
+
+def get_node_roles(principal, node):
+    """ Local roles of `principal` granted on `node` and its parents,
+    loaded with one query. Roles of owner and roles providers
+    are not included, see :py:func:`ptah.get_local_roles`.
+
+    :param principal: Principal uri
+    :param node: Node or node uri
+    """
+    uri = getattr(node, '__uri__', node)
+    return sorted(role for role, in
+                  _sql_node_roles.all(principal=principal, uri=uri))
+
+
+def get_principal_nodes(principal, roles=None):
+    """ Uris of nodes with local roles granted to `principal`,
+    descendants of these nodes inherit roles.
+
+    :param principal: Principal uri
+    :param roles: Sequence of roles, by default any role
+    """
+    table = LocalRole.__table__
+    query = sqla.select([table.c.node], table.c.principal == principal)
+    if roles is not None:
+        query = query.where(table.c.role.in_(list(roles)))
+
+    return sorted(set(
+        uri for uri, in ptah.get_session().execute(query.distinct())))
+
+
+def rebuild_local_roles(chunksize=500):
+    """ Rebuild local roles table from `Node.__local_roles__` columns.
+    Returns number of rows. """
+    Session = ptah.get_session()
+    Session.flush()
+
+    nodes = Node.__table__
+    table = LocalRole.__table__
+    Session.execute(table.delete())
+
+    count = 0
+    rows = []
+    for uri, local_roles in Session.execute(
+            sqla.select([nodes.c.uri, nodes.c.roles])):
+        rows.extend(local_roles_rows(uri, local_roles))
+        if len(rows) >= chunksize:
+            Session.execute(table.insert(), rows)
+            count += len(rows)
+            rows = []
+
+    if rows:
+        Session.execute(table.insert(), rows)
+        count += len(rows)
+
+    return count
+
+
+def permission_clause(parent, permission):
+    """ Sql clause for child nodes of `parent` with `permission`
+    for current principal. Effective acl and local roles of `parent`
+    are evaluated in python, `__acls__`, `__owner__` and local roles
+    of children are checked by sql. Returns None if permission can't be
+    checked with sql: `ptah.check_permission` is replaced, custom
+    authorization policy or roles providers other than
+    `ptah.default_roles` setting are used.
+
+    :param parent: Parent node, `__parent__` chain has to be loaded
+    :param permission: Permission
+    """
+    if not permission or permission == ptah.NO_PERMISSION_REQUIRED:
+        return TRUE
+    if permission == ptah.NOT_ALLOWED:
+        return FALSE
+
+    userid = ptah.auth_service.get_effective_userid()
+    if userid == ptah.SUPERUSER_URI:
+        return TRUE
+
+    registry = get_current_registry()
+    if custom_security(registry):
+        return None
+
+    provider_roles, providers = roles_providers(registry, userid)
+    if providers:
+        return None
+
+    principals = set((ptah.Everyone.id,))
+    if userid is not None:
+        principals.update((ptah.Authenticated.id, userid))
+        principals.update(provider_roles)
+
+    roles, aces = _lineage_security(parent, userid, permission)
+    principals.update(roles)
+
+    # children with same acls share acl entries
+    nodes = Node.__table__
+    acls = sqla.sql.type_coerce(nodes.c.acls, sqla.UnicodeText)
+
+    clauses = []
+    for value, in ptah.get_session().execute(
+            sqla.select([acls], nodes.c.parent == parent.__uri__).distinct()):
+        names = nodes.c.acls.type.process_result_value(value, None)
+        entries = _permission_entries(ACLsMerge(names or ()), permission)
+
+        clause = _entries_clause(entries + aces, principals, userid)
+        if clause is not False:
+            match = acls == None if value is None else acls == value
+            clauses.append(match if clause is True else sqla.and_(match, clause))
+
+    if not clauses:
+        return FALSE
+    return sqla.or_(*clauses)
+
+
+TRUE = sqla.sql.literal(1) == 1
+FALSE = sqla.sql.literal(1) == 0
+
+
+def _entries_clause(entries, principals, userid):
+    """ First matching acl entry decides, returns True, False
+    or sql clause for roles of node owner and node local roles """
+    nodes = Node.__table__
+    roles = LocalRole.__table__
+
+    clause = False
+    for action, principal in reversed(entries):
+        if principal in principals:
+            clause = action == Allow
+            continue
+
+        if userid is None:
+            continue
+
+        if principal == ptah.Owner.id:
+            match = sqla.func.coalesce(nodes.c.owner, '') == userid
+        else:
+            match = sqla.sql.exists().where(sqla.and_(
+                roles.c.node == nodes.c.uri,
+                roles.c.principal == userid,
+                roles.c.role == principal))
+
+        if action == Allow:
+            clause = True if clause is True else \
+                match if clause is False else sqla.or_(match, clause)
+        else:
+            clause = False if clause is False else \
+                sqla.not_(match) if clause is True else \
+                sqla.and_(sqla.not_(match), clause)
+
+    return clause
@@ -1,16 +1,61 @@
 """ Node implementation """
+import weakref
 import sqlalchemy as sa
 from collections import OrderedDict
 from pyramid.compat import text_type
 from zope.interface import implementer
 
 import ptah
+from ptah import config
+from ptah.uri import ID_RESOLVER
+from ptah.sqlautils import JsonType, MutationDict, MutationList
 from ptahcms import action
+from ptahcms.security import check_permission, clear_permissions
+from ptahcms.settings import CFG_ID_CMS
 from ptahcms.permissions import View
 from ptahcms.interfaces import NotFound, Forbidden
 from ptahcms.interfaces import INode, IApplicationPolicy
 
 
+def security_changed(node):
+    """ Local roles, acls, owner or parent of node are changed,
+    permissions of node and its descendants have to be checked again """
+    state = sa.orm.attributes.instance_state(node)
+    if state.key is not None or node.__dict__.get('__uri__') is not None:
+        clear_permissions()
+
+
+class LocalRolesDict(MutationDict):
+    """ `Node.__local_roles__` value, in place changes clear
+    permissions memo """
+
+    @classmethod
+    def coerce(cls, key, value):
+        if not isinstance(value, cls) and isinstance(value, dict):
+            return cls(value)
+        return MutationDict.coerce(key, value)
+
+    def changed(self):
+        super(LocalRolesDict, self).changed()
+        for node in list(self._parents.keys()):
+            security_changed(node)
+
+
+class ACLsList(MutationList):
+    """ `Node.__acls__` value, in place changes clear permissions memo """
+
+    @classmethod
+    def coerce(cls, key, value):
+        if not isinstance(value, cls) and isinstance(value, list):
+            return cls(value)
+        return MutationList.coerce(key, value)
+
+    def changed(self):
+        super(ACLsList, self).changed()
+        for node in list(self._parents.keys()):
+            security_changed(node)
+
+
 @implementer(INode,
              ptah.IACLsAware,
              ptah.IOwnersAware,
@@ -67,16 +112,19 @@ class Node(ptah.get_base()):
     __uri__ = sa.Column('uri', sa.String(255), unique=True,
                         nullable=False, info={'uri':True})
     __parent_uri__ = sa.Column('parent', sa.String(255),
-                               sa.ForeignKey(__uri__), info={'uri': True})
+                               sa.ForeignKey(__uri__), index=True,
+                               info={'uri': True})
 
     __owner__ = sa.Column('owner', sa.String(255), default='',info={'uri':True})
-    __local_roles__ = sa.Column('roles', ptah.JsonDictType(), default={})
-    __acls__ = sa.Column('acls', ptah.JsonListType(), default=[])
+    __local_roles__ = sa.Column(
+        'roles', LocalRolesDict.as_mutable(JsonType()), default={})
+    __acls__ = sa.Column(
+        'acls', ACLsList.as_mutable(JsonType()), default=[])
     __annotations__ = sa.Column('annotations', ptah.JsonDictType(),default={})
 
     __children__ = sa.orm.relationship(
         'Node', backref=sa.orm.backref('__parent_ref__', remote_side=[__uri__]),
-        cascade='all', lazy='joined', join_depth=1)
+        cascade='all')
 
     __mapper_args__ = {'polymorphic_on': __type_id__, 'with_polymorphic': '*'}
 
@@ -85,6 +133,11 @@ class Node(ptah.get_base()):
 
     __acl__ = ptah.ACLsProperty()
 
+    # sql queries
+    _sql_ancestors = ptah.QueryFreezer(
+        lambda: node_query(Node, lean=True)
+            .filter(Node.__uri__.in_(_ancestors_cte())))
+
     def __init__(self, **kw):
         self.__owners__ = []
         self.__local_roles__ = {}
@@ -116,6 +169,70 @@ class Node(ptah.get_base()):
     def get_session(self):
         return sa.orm.object_session(self)
 
+    def _load_ancestors(self):
+        """ Load all parents of node with one query.
+        Returns dictionary of loaded nodes by uri. """
+        if not self.__parent_uri__:
+            return {}
+
+        parents = self._sql_ancestors.all(uri=self.__parent_uri__)
+        return dict((p.__uri__, p) for p in idmap_add(*parents))
+
+
+def node_security_changed(target, value, oldvalue, initiator):
+    if value is not oldvalue:
+        security_changed(target)
+
+for attr in (Node.__local_roles__, Node.__acls__,
+             Node.__owner__, Node.__parent_uri__):
+    sa.event.listen(attr, 'set', node_security_changed, propagate=True)
+
+
+CHILDREN_LOADERS = {
+    'select': sa.orm.lazyload,
+    'joined': sa.orm.joinedload,
+    'subquery': sa.orm.subqueryload,
+    'noload': sa.orm.noload,
+}
+
+def node_query(cls, lean=False, children=None):
+    """ Query for `cls` nodes. `__children__` are loaded with `children`
+    strategy, by default strategy from `ptahcms.children_loading`
+    setting is used. Lean query selects only tables of `cls` and its
+    base classes, columns of subclasses are loaded on first access.
+
+    :param cls: Node class
+    :param lean: Do not join tables of `cls` subclasses
+    :param children: `select`, `joined`, `subquery` or `noload`.
+        Nodes loaded with `noload` must not be deleted, `__children__`
+        collection is empty and delete doesn't cascade.
+    """
+    query = ptah.get_session().query(cls)
+    if lean:
+        query = query.with_polymorphic(cls)
+
+    if children is None:
+        children = ptah.get_settings(CFG_ID_CMS)['children_loading']
+
+    return query.options(
+        CHILDREN_LOADERS.get(children, sa.orm.lazyload)('__children__'))
+
+
+def _ancestors_cte():
+    nodes = Node.__table__
+
+    ancestors = sa.select([nodes.c.uri, nodes.c.parent])\
+        .where(nodes.c.uri == sa.sql.bindparam('uri'))\
+        .cte('ancestors', recursive=True)
+
+    child = ancestors.alias()
+    parent = nodes.alias()
+    ancestors = ancestors.union_all(
+        sa.select([parent.c.uri, parent.c.parent])
+            .where(parent.c.uri == child.c.parent))
+
+    return sa.select([ancestors.c.uri])
+
 
 def load(uri, permission=None):
     """ Load node by `uri` and initialize __parent__ attributes. Also checks
@@ -133,7 +250,7 @@ def load(uri, permission=None):
         load_parents(item)
 
         if permission is not None:
-            if not ptah.check_permission(permission, item):
+            if not check_permission(permission, item):
                 raise Forbidden()
     else:
         raise NotFound(uri)
@@ -141,20 +258,65 @@ def load(uri, permission=None):
     return item
 
 
+def resolve_many(uris, chunksize=500):
+    """ Resolve sequence of uris. Returns list of resolved objects in
+    order of `uris`, None for unresolved uri. Nodes served by ptahcms
+    resolvers are loaded with one polymorphic query per `chunksize` uris,
+    other uris are resolved with :py:func:`ptah.resolve`.
+
+    :param uris: Sequence of uris
+    :param chunksize: Maximum number of uris in one sql query
+    """
+    resolvers = config.get_cfg_storage(ID_RESOLVER)
+
+    found = {}
+    missing = []
+    for uri in uris:
+        if uri in found:
+            continue
+
+        node = idmap_get(uri)
+        if node is not None:
+            found[uri] = node
+            continue
+
+        resolver = resolvers.get(ptah.extract_uri_schema(uri))
+        if getattr(resolver, '__node_resolver__', False):
+            found[uri] = None
+            missing.append(uri)
+        else:
+            found[uri] = ptah.resolve(uri)
+
+    for idx in range(0, len(missing), chunksize):
+        for node in node_query(Node)\
+                .filter(Node.__uri__.in_(missing[idx:idx+chunksize])):
+            found[node.__uri__] = node
+            idmap_add(node)
+
+    return [found[uri] for uri in uris]
+
+
 def load_parents(node):
     """ Load and initialize `__parent__` attribute for node.
-    Returns list of loaded parents.
+    Returns list of loaded parents. All not yet loaded parents
+    are fetched with one query, see :py:meth:`Node._load_ancestors`.
 
     :param node: ptahcms.Node node
     """
     parents = []
     parent = node
+    ancestors = None
     while parent is not None:
         if not isinstance(parent, Node):
             break
 
-        if parent.__parent__ is None:
-            parent.__parent__ = parent.__parent_ref__
+        if parent.__parent__ is None and parent.__parent_uri__:
+            if ancestors is None:
+                ancestors = parent._load_ancestors()
+
+            parent.__parent__ = ancestors.get(parent.__parent_uri__)
+            if parent.__parent__ is None:
+                parent.__parent__ = parent.__parent_ref__
 
         parent = parent.__parent__
         if parent is not None:
@@ -171,6 +333,40 @@ def load_parents(node):
     return [p for p in parents if isinstance(p, Node)]
 
 
+IDMAP_KEY = '__ptahcms_idmap__'
+
+def idmap_get(uri):
+    """ Get node from request identity map. Returns None if node is
+    not in map or node doesn't belong to current sqlalchemy session. """
+    idmap = ptah.tldata.get(IDMAP_KEY)
+    if idmap:
+        node = idmap.get(uri)
+        if node is not None and node in ptah.get_session():
+            return node
+
+    return None
+
+def idmap_add(*nodes):
+    """ Add nodes to request identity map, returns added nodes """
+    idmap = ptah.tldata.get(IDMAP_KEY)
+    if idmap is None:
+        idmap = weakref.WeakValueDictionary()
+        ptah.tldata.set(IDMAP_KEY, idmap)
+
+    for node in nodes:
+        idmap[node.__uri__] = node
+
+    return nodes
+
+
+@ptah.subscriber(ptah.events.UriInvalidateEvent)
+def idmap_invalidate(ev):
+    """ Remove invalidated uri from request identity map """
+    idmap = ptah.tldata.get(IDMAP_KEY)
+    if idmap:
+        idmap.pop(ev.uri, None)
+
+
 KEY = '__ptahcms_policy__'
 
 def get_policy():
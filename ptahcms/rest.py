@@ -1,20 +1,32 @@
 """ rest api for cms """
+import logging
+import transaction
 from collections import OrderedDict
 from zope.interface import providedBy, implementer, Interface
-from pyramid.compat import bytes_
+from pyramid.compat import bytes_, url_encode
+from pyramid.request import Request
+from pyramid.response import Response, FileIter
+from pyramid.httpexceptions import WSGIHTTPException, HTTPBadRequest
 
 import ptah
 from ptah import config
 
 import ptahcms
 from ptahcms import wrap
+from ptahcms.security import check_permission
 from ptahcms import RestService
+from ptahcms.restsrv import parse_subpath
 from ptahcms.node import load
 from ptahcms.container import Container
 from ptahcms.interfaces import NotFound, TypeException
-from ptahcms.interfaces import INode, IBlob, IContent, IContainer
+from ptahcms.blob import BlobIter
+from ptahcms.blobfs import BLOCK_SIZE
+from ptahcms.settings import CFG_ID_CMS
+from ptahcms.interfaces import INode, IBlob, IFSBlob, IContent, IContainer
 from ptahcms.permissions import View, ModifyContent, DeleteContent
 
+log = logging.getLogger('ptahcms')
+
 ID_CMS_REST = 'ptah-cms:rest-action'
 CMS = RestService('cms', 'Ptah CMS API')
 
@@ -53,6 +65,70 @@ def cmsTypes(request, *args):
     return [info for _t, name, info in sorted(types)]
 
 
+@CMS.action('batch', 'Batch of operations')
+def cmsBatch(request, *args):
+    """Execute list of operations in one transaction. Request body is json
+    list of operations, operation is object with `path` of cms rest action,
+    for example `content/type-page:1/update`, and optional `GET` and `POST`
+    parameters. Returns list of `status` and `result` of operations.
+    Execution stops on first failed operation, transaction is aborted
+    and response status is set to status of failed operation, 500 for
+    unexpected errors."""
+    try:
+        operations = request.json_body
+    except ValueError:
+        raise HTTPBadRequest('List of operations is required')
+
+    if not isinstance(operations, list):
+        raise HTTPBadRequest('List of operations is required')
+
+    url = request.application_url
+    roots = {}
+    results = []
+    for op in operations:
+        try:
+            if not isinstance(op, dict):
+                raise HTTPBadRequest('Operation has to be object')
+
+            subpath = tuple(p for p in op.get('path', '').split('/') if p)
+            action, arguments = parse_subpath(subpath)
+
+            sub = Request.blank(
+                '/?%s' % url_encode(op.get('GET', {}), True), base_url=url)
+            sub.registry = request.registry
+            sub.subpath = subpath
+            sub.cms_roots = roots
+            if op.get('POST'):
+                sub.method = 'POST'
+                sub.content_type = 'application/x-www-form-urlencoded'
+                sub.body = bytes_(url_encode(op['POST'], True), 'utf-8')
+
+            if action == 'batch':
+                raise HTTPBadRequest('Nested batch is not allowed')
+
+            result = CMS(sub, action, *arguments)
+            if isinstance(result, Response):
+                raise HTTPBadRequest('Action response is not supported')
+
+            status = sub.response.status_int
+        except WSGIHTTPException as exc:
+            status = exc.code
+            result = {'message': str(exc)}
+        except Exception as exc:
+            log.exception('Batch operation failed')
+            status = 500
+            result = {'message': str(exc)}
+
+        results.append(OrderedDict((('status', status), ('result', result))))
+
+        if status >= 400:
+            transaction.doom()
+            request.response.status = status
+            break
+
+    return results
+
+
 def typeInfo(tinfo, request):
     info = OrderedDict(
         (('__uri__', tinfo.__uri__),
@@ -89,9 +165,17 @@ def cmsContent(request, app='', uri=None, action='', *args):
 
     content = None
 
-    appfactory = ptahcms.get_app_factories().get(app)
-    if appfactory is not None:
-        root = appfactory(request)
+    # batch operations share application roots
+    roots = getattr(request, 'cms_roots', None)
+    root = roots.get(app) if roots is not None else None
+    if root is None:
+        appfactory = ptahcms.get_app_factories().get(app)
+        if appfactory is not None:
+            root = appfactory(request)
+            if roots is not None:
+                roots[app] = root
+
+    if root is not None:
         request.root = root
 
         if not uri:
@@ -114,7 +198,7 @@ def cmsContent(request, app='', uri=None, action='', *args):
             request.environ['SCRIPT_NAME'] = '%s/content/'%(
                 request.environ['SCRIPT_NAME'])
 
-        ptah.check_permission(action.permission, content, request, True)
+        check_permission(action.permission, content, request, True)
         res = action.callable(content, request, *args)
         if not res: # pragma: no cover
             res = {}
@@ -179,14 +263,40 @@ def nodeInfo(content, request, *args):
 
 @restaction('', IContainer, View)
 def containerNodeInfo(content, request, *args):
-    """Container information"""
+    """Container information, contents are listed by pages of
+    `ptahcms.rest_page_size` items. `limit`, `after`, `order` and `reverse`
+    parameters select page, `__next__` is cursor of next page"""
     info = nodeInfo(content, request)
 
-    contents = []
-    for item in content.values():
-        if not ptah.check_permission(View, item, request): # pragma: no cover
-            continue
+    params = request.GET
+    cfg = ptah.get_settings(CFG_ID_CMS, request.registry)
+    page_size = cfg['rest_page_size']
 
+    limit = params.get('limit')
+    if limit:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            raise HTTPBadRequest('Limit has to be positive integer')
+        limit = min(limit, page_size)
+    else:
+        limit = page_size
+
+    order = params.get('order', 'name')
+    if order not in ('name', 'created', 'modified'):
+        raise HTTPBadRequest('Unknown order: %s' % order)
+
+    try:
+        values, cursor = content.page(
+            limit, params.get('after') or None, order,
+            params.get('reverse') in ('1', 'true'), permission=View)
+    except ValueError:
+        raise HTTPBadRequest('Invalid cursor')
+
+    contents = []
+    for item in values:
         contents.append(
             OrderedDict((
                     ('__name__', item.__name__),
@@ -202,6 +312,7 @@ def containerNodeInfo(content, request, *args):
                     )))
 
     info['__contents__'] = contents
+    info['__next__'] = cursor
     return info
 
 
@@ -213,7 +324,7 @@ def apidocAction(content, request, *args):
     for name, action in request.registry.adapters.lookupAll(
         (IRestActionClassifier, providedBy(content)), IRestAction):
 
-        if not ptah.check_permission(
+        if not check_permission(
             action.permission, content, request):
             continue
 
@@ -234,6 +345,12 @@ def deleteAction(content, request, *args):
     content.delete()
 
 
+@restaction('batchdelete', IContainer, DeleteContent)
+def batchDeleteAction(content, request, *args):
+    """Delete container items, item uris are passed as `uri` parameters"""
+    return {'deleted': content.batchdelete(request.POST.getall('uri'))}
+
+
 @restaction('move', IContent, ModifyContent)
 def moveAction(content, request, *args):
     """Move content"""
@@ -285,5 +402,22 @@ def blobData(content, request, *args):
             bytes_('filename="{0}"'.format(info['filename']), 'utf-8')
 
     response.headers = headers
-    response.body = content.read()
+    if IFSBlob.providedBy(content) and 'HTTP_RANGE' not in request.environ:
+        f = content.open()
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            response.app_iter = file_wrapper(f, BLOCK_SIZE)
+        else:
+            response.app_iter = FileIter(f, BLOCK_SIZE)
+    else:
+        response.app_iter = BlobIter(content)
+    response.content_length = info['size']
+
+    # conditional and range requests are handled by webob
+    response.conditional_response = True
+    response.accept_ranges = 'bytes'
+    if getattr(content, 'hash', None):
+        response.etag = content.hash
+    if getattr(content, 'modified', None):
+        response.last_modified = content.modified
     return response
@@ -1,16 +1,25 @@
 """ ptah rest api """
+import time
+import hashlib
+import threading
 import traceback
 from datetime import datetime
-from json import dumps
+from json import JSONEncoder
 from collections import OrderedDict
 from pyramid.view import view_config
-from pyramid.compat import NativeIO, text_
+from pyramid.compat import NativeIO, bytes_
 from pyramid.response import Response
 from pyramid.authentication import parse_ticket, AuthTicket, BadTicket
 from pyramid.httpexceptions import WSGIHTTPException, HTTPNotFound
 
 import ptah
 from ptah import config
+from ptahcms.settings import CFG_ID_CMS
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
 
 
 ID_REST = 'ptah:rest-service'
@@ -120,6 +129,153 @@ def dthandler(obj):
     return obj.isoformat() if isinstance(obj, datetime) else None
 
 
+compact_encoder = JSONEncoder(separators=(',', ':'), default=dthandler)
+pretty_encoder = JSONEncoder(indent=2, default=dthandler)
+
+
+class JSONIter(object):
+    """ Response iterator, encodes `result` to json incrementally
+    and yields utf-8 chunks of about `bufsize` bytes. """
+
+    bufsize = 65536
+
+    def __init__(self, result, pretty=False):
+        self.result = result
+        self.pretty = pretty
+
+    def __iter__(self):
+        encoder = pretty_encoder if self.pretty else compact_encoder
+
+        buf = []
+        size = 0
+        for chunk in encoder.iterencode(self.result):
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= self.bufsize:
+                yield ''.join(buf).encode('utf-8')
+                buf = []
+                size = 0
+
+        if buf:
+            yield ''.join(buf).encode('utf-8')
+
+
+def orjson_iter(result, pretty=False):
+    """ Encode `result` with orjson. Result is encoded at once,
+    datetime objects are encoded natively by orjson. """
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+
+    return (orjson.dumps(result, default=dthandler, option=option),)
+
+
+JSON_BACKENDS = {'json': JSONIter}
+if orjson is not None: # pragma: no cover
+    JSON_BACKENDS['orjson'] = orjson_iter
+
+
+def get_json_backend(name):
+    """ Json encoder by name, `auto` selects fastest installed encoder.
+    Encoder is callable with `result` and `pretty` arguments that returns
+    iterable of encoded chunks, see :py:data:`JSON_BACKENDS` """
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in JSON_BACKENDS else 'json'
+
+    return JSON_BACKENDS.get(name, JSONIter)
+
+
+def render_json(request, result, pretty=False, backend='json'):
+    """ Set json encoded `result` as body of request response """
+    response = request.response
+    response.content_type = 'application/json'
+    response.app_iter = get_json_backend(backend)(result, pretty)
+    return response
+
+
+class TokenCache(object):
+    """ Bounded LRU cache of verified auth tokens. Entries are keyed
+    by digest of secret and token, so tokens are verified again
+    after secret change. Entry expires after `ttl` seconds. """
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def key(secret, token):
+        return hashlib.sha256(
+            bytes_('%s!%s' % (secret, token), 'utf-8')).hexdigest()
+
+    def get(self, key):
+        """ Userid of verified token or None """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+
+            expires, userid = entry
+            if expires < time.time():
+                self._remove(key, userid)
+                return None
+
+            self._data[key] = entry
+            return userid
+
+    def set(self, key, userid, size, ttl):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._remove(key, entry[1])
+
+            self._data[key] = (time.time() + ttl, userid)
+            self._users.setdefault(userid, set()).add(key)
+
+            while len(self._data) > size:
+                old_key, (expires, old_userid) = self._data.popitem(False)
+                self._remove(old_key, old_userid)
+
+    def invalidate(self, userid):
+        """ Remove all tokens of `userid` """
+        with self._lock:
+            for key in self._users.pop(userid, ()):
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._users.clear()
+
+    def _remove(self, key, userid):
+        keys = self._users.get(userid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._users[userid]
+
+
+token_cache = TokenCache()
+
+
+@ptah.subscriber(ptah.events.LoggedOutEvent)
+def logout_handler(ev):
+    """ Remove cached tokens of logged out principal """
+    userid = getattr(ev.principal, '__uri__', None)
+    if userid:
+        token_cache.invalidate(userid)
+
+
+@ptah.subscriber(ptah.events.SettingsGroupModified)
+def settings_modified_handler(ev):
+    """ Remove cached tokens, auth secret could be changed """
+    if ev.object.__name__ == ptah.CFG_ID_PTAH:
+        token_cache.clear()
+
+
 @view_config(context=RestLoginRoute)
 class Login(object):
     """ Rest login view """
@@ -143,10 +299,7 @@ class Login(object):
             response.status = 403
             result = {'message': info.message or 'authentication failed'}
 
-        response.headerslist = {'Content-Type': 'application/json'}
-        response.text = text_(
-            dumps(result, indent=True, default=dthandler), 'utf-8')
-        return response
+        return render_json(request, result)
 
     def get_token(self, request, userid):
         secret = ptah.get_settings(
@@ -169,36 +322,38 @@ class Login(object):
 def Api(request):
     """ Rest API interface """
     response = request.response
+    cfg = ptah.get_settings(CFG_ID_CMS, request.registry)
 
     # authentication by token
     token = request.environ.get('HTTP_X_AUTH_TOKEN')
     if token:
         secret = ptah.get_settings(ptah.CFG_ID_PTAH, request.registry)['secret']
 
-        try:
-            timestamp, userid, tokens, user_data = parse_ticket(
-                secret, '%s!' % token, '0.0.0.0')
-        except BadTicket:
-            userid = None
+        userid = None
+        cache_size = cfg['rest_token_cache_size']
+        if cache_size:
+            key = token_cache.key(secret, token)
+            userid = token_cache.get(key)
+
+        if userid is None:
+            try:
+                timestamp, userid, tokens, user_data = parse_ticket(
+                    secret, '%s!' % token, '0.0.0.0')
+            except BadTicket:
+                userid = None
+
+            if userid and cache_size:
+                token_cache.set(
+                    key, userid, cache_size, cfg['rest_token_cache_ttl'])
 
         if userid:
             ptah.auth_service.set_userid(userid)
 
     # search service and action
     service = request.matchdict['service']
-    subpath = request.matchdict['subpath']
-    if subpath:
-        action = subpath[0]
-        arguments = subpath[1:]
-        if ':' in action:
-            action, arg = action.split(':', 1)
-            arguments = (arg,) + arguments
-    else:
-        action = 'apidoc'
-        arguments = ()
+    action, arguments = parse_subpath(request.matchdict['subpath'])
 
     request.environ['SCRIPT_NAME'] = '/__rest__/%s' % service
-    response.headerslist = {'Content-Type': 'application/json'}
 
     # execute action for specific service
     try:
@@ -219,9 +374,24 @@ def Api(request):
     if isinstance(result, Response):
         return result
 
-    response.text = text_(
-        dumps(result, indent=True, default=dthandler), 'utf-8')
-    return response
+    return render_json(
+        request, result, cfg['rest_pretty_json'], cfg['rest_json_backend'])
+
+
+def parse_subpath(subpath):
+    """ Returns action name and arguments for rest url subpath,
+    `action:arg/arg2` is `('action', ('arg', 'arg2'))` """
+    if subpath:
+        action = subpath[0]
+        arguments = tuple(subpath[1:])
+        if ':' in action:
+            action, arg = action.split(':', 1)
+            arguments = (arg,) + arguments
+    else:
+        action = 'apidoc'
+        arguments = ()
+
+    return action, arguments
 
 
 def enable_rest_api(config):
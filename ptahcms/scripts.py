@@ -0,0 +1,92 @@
+""" ptahcms-blobgc, ptahcms-localroles and ptahcms-jsonbench commands """
+from __future__ import print_function
+import timeit
+import argparse
+import transaction
+from datetime import datetime
+from collections import OrderedDict
+
+import ptah
+from ptah import scripts
+from ptahcms.blob import gc_payloads
+from ptahcms.localroles import rebuild_local_roles
+from ptahcms.restsrv import JSON_BACKENDS
+
+
+def blobgc():
+    parser = argparse.ArgumentParser(
+        description="remove blob payloads without references")
+    parser.add_argument('config', metavar='config',
+                        help='ini config file')
+    args = parser.parse_args()
+
+    scripts.bootstrap(args.config)
+
+    with transaction.manager:
+        removed = gc_payloads()
+
+    print('Removed blob payloads: {0}'.format(removed))
+
+    ptah.shutdown()
+
+
+def localroles():
+    parser = argparse.ArgumentParser(
+        description="rebuild materialized local roles table")
+    parser.add_argument('config', metavar='config',
+                        help='ini config file')
+    args = parser.parse_args()
+
+    scripts.bootstrap(args.config)
+
+    with transaction.manager:
+        count = rebuild_local_roles()
+
+    print('Local roles: {0}'.format(count))
+
+    ptah.shutdown()
+
+
+def json_payload(items):
+    """ Container rest info with `items` contents """
+    now = datetime.now()
+    url = 'http://localhost:8080/__rest__/cms/content/'
+
+    return OrderedDict((
+        ('__type__', 'type-folder'),
+        ('__content__', True),
+        ('__uri__', 'type-folder:0'),
+        ('__parents__', []),
+        ('__link__', '%stype-folder:0/' % url),
+        ('__contents__', [
+            OrderedDict((
+                ('__name__', 'item-%s' % idx),
+                ('__type__', 'type-page'),
+                ('__uri__', 'type-page:%s' % idx),
+                ('__container__', False),
+                ('__link__', '%stype-page:%s/' % (url, idx)),
+                ('title', 'Page %s' % idx),
+                ('description', 'Description of page %s' % idx),
+                ('created', now),
+                ('modified', now))) for idx in range(items)]),
+        ))
+
+
+def jsonbench():
+    parser = argparse.ArgumentParser(
+        description="compare json encoders of rest api")
+    parser.add_argument('-i', '--items', type=int, default=1000,
+                        help='number of container items')
+    parser.add_argument('-n', '--number', type=int, default=20,
+                        help='number of encodings per measure')
+    parser.add_argument('--pretty', action='store_true',
+                        help='indented output')
+    args = parser.parse_args()
+
+    payload = json_payload(args.items)
+
+    for name, backend in sorted(JSON_BACKENDS.items()):
+        timer = timeit.Timer(
+            lambda: b''.join(backend(payload, args.pretty)))
+        best = min(timer.repeat(3, args.number)) / args.number
+        print('{0:>8}: {1:.2f} ms'.format(name, best * 1000))
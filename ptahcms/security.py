@@ -1,51 +1,191 @@
 import inspect
-from pyramid.compat import string_types
+import weakref
+import functools
+import transaction
+from pyramid.compat import string_types, is_nonstr_iter
+from pyramid.location import lineage
+from pyramid.security import Allow
+from pyramid.interfaces import IAuthorizationPolicy
+from pyramid.httpexceptions import HTTPForbidden
+from pyramid.authorization import ACLAuthorizationPolicy
+from pyramid.threadlocal import get_current_registry, get_current_request
 
 import ptah
 import ptahcms
 from ptah import config
+from ptah.security import ID_ROLES_PROVIDER, PtahAuthorizationPolicy
+from ptah.security import ptah_default_roles
+from ptah.security import check_permission as ptah_check_permission
 from ptahcms.permissions import View
-from ptahcms.interfaces import NotFound, Forbidden
+from ptahcms.interfaces import NotFound, Forbidden, IApplicationPolicy
+
+
+PERMISSIONS_KEY = '__ptahcms_permissions__'
+
+def check_permission(permission, content, request=None, throw=False):
+    """ Check `permission` within `content`, results are memoized for
+    current request and transaction by principal, content uri and
+    permission. Results are memoized only if `__parent__` lineage of
+    content is loaded up to application policy. Memo is cleared when
+    local roles, acls, owner or parent of any node are changed, see
+    :py:func:`clear_permissions`. Arguments are same as for
+    :py:func:`ptah.check_permission`. """
+    uri = getattr(content, '__uri__', None)
+    if uri is None or ptah.check_permission is not ptah_check_permission:
+        return ptah.check_permission(permission, content, request, throw)
+
+    memo = None
+    if lineage_loaded(content):
+        memo = permissions_memo(request)
+
+    if memo is None:
+        return ptah.check_permission(permission, content, request, throw)
+
+    key = (ptah.auth_service.get_effective_userid(), uri, permission)
+    allowed = memo.get(key)
+    if allowed is None:
+        try:
+            allowed = bool(
+                ptah.check_permission(permission, content, request, throw))
+        except HTTPForbidden:
+            memo[key] = False
+            raise
+        memo[key] = allowed
+
+    if not allowed and throw:
+        raise HTTPForbidden()
+
+    return allowed
+
+
+def permissions_memo(request=None):
+    """ Permissions memo of `request` or current request for current
+    transaction. Returns None if there is no request. """
+    if request is None:
+        request = get_current_request()
+        if request is None:
+            return None
+
+    txn = transaction.get()
+    memo = getattr(request, PERMISSIONS_KEY, None)
+    if memo is None or memo[0] is not txn:
+        memo = (txn, {})
+        setattr(request, PERMISSIONS_KEY, memo)
+
+    return memo[1]
+
+
+def clear_permissions(request=None):
+    """ Clear permissions memo of `request` or current request """
+    if request is None:
+        request = get_current_request()
+
+    if getattr(request, PERMISSIONS_KEY, None) is not None:
+        setattr(request, PERMISSIONS_KEY, None)
+
+
+def lineage_loaded(content):
+    """ `__parent__` lineage of `content` is loaded up to
+    application policy, see :py:func:`ptahcms.load_parents` """
+    root = None
+    for root in lineage(content):
+        pass
+
+    return IApplicationPolicy.providedBy(root)
 
 
 def wrap(content):
+    """ Wrap `content` or content uri for permission checked action calls,
+    see :py:class:`NodeWrapper`. Wrapper is returned as is. Parents of
+    content object are loaded on first permission check. """
+    if isinstance(content, NodeWrapper):
+        return content
+
     if isinstance(content, string_types):
         content = ptahcms.load(content)
-    else:
-        ptahcms.load_parents(content)
+        if content is None:
+            raise NotFound()
+        return NodeWrapper(content)
 
     if content is None:
         raise NotFound()
 
-    return NodeWrapper(content)
+    return NodeWrapper(content, False)
 
 
 class NodeWrapper(object):
+    """ Calls actions of `content` with permission check. Actions are
+    dispatched with action table of content class, see
+    :py:func:`class_actions`. If `parents_loaded` is False, parents of
+    content are loaded before first permission check. """
+
+    __slots__ = ('_content', '_actions', '_parents_loaded')
 
-    def __init__(self, content):
+    def __init__(self, content, parents_loaded=True):
         self._content = content
-        self._actions = getattr(content, '__ptahcms_actions__', None)
+        self._actions = class_actions(content.__class__)
+        self._parents_loaded = parents_loaded
 
     def __getattr__(self, action):
-        if not self._actions or action not in self._actions:
+        try:
+            fname, checker = self._actions.dispatch[action]
+        except KeyError:
             raise NotFound(action)
 
-        fname, permission = self._actions[action]
-        if permission:
-            if not ptah.check_permission(permission, self._content):
+        if checker is not None:
+            if not self._parents_loaded:
+                ptahcms.load_parents(self._content)
+                self._parents_loaded = True
+
+            if not checker(self._content):
                 raise Forbidden(action)
 
-        return ActionWrapper(self._content, fname)
+        return getattr(self._content, fname)
+
+
+class ActionTable(object):
+    """ Immutable mapping of action name to `(fname, permission)`,
+    `dispatch` maps action name to `(fname, checker)` where checker is
+    permission check bound to action permission or None if permission
+    is not required """
+
+    __slots__ = ('_actions', 'dispatch')
+
+    def __init__(self, actions):
+        actions = dict(actions)
+        dispatch = {}
+        for name, (fname, permission) in actions.items():
+            checker = None
+            if permission and permission != ptah.NO_PERMISSION_REQUIRED:
+                checker = functools.partial(check_permission, permission)
+            dispatch[name] = (fname, checker)
+
+        object.__setattr__(self, '_actions', actions)
+        object.__setattr__(self, 'dispatch', dispatch)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ActionTable is immutable")
 
+    def __getitem__(self, name):
+        return self._actions[name]
 
-class ActionWrapper(object):
+    def __contains__(self, name):
+        return name in self._actions
 
-    def __init__(self, content, action):
-        self.content = content
-        self.action = action
+    def __iter__(self):
+        return iter(self._actions)
 
-    def __call__(self, *args, **kw):
-        return getattr(self.content, self.action)(*args, **kw)
+    def __len__(self):
+        return len(self._actions)
+
+    def get(self, name, default=None):
+        return self._actions.get(name, default)
+
+    def keys(self):
+        return self._actions.keys()
+
+    def items(self):
+        return self._actions.items()
 
 
 def action(func=None, name=None, permission = View):
@@ -70,9 +210,17 @@ def action(func=None, name=None, permission = View):
 
 
 def build_class_actions(cls):
-    actions = cls.__dict__.get('__ptahcms_actions__', None)
-    if actions is None:
-        actions = {}
+    """ Merge actions of `cls` and its base classes, returns
+    :py:class:`ActionTable` of `cls` """
+    cls.__ptahcms_actions__ = actions = merge_actions(cls)
+
+    _action_tables[cls] = table = ActionTable(actions)
+    return table
+
+
+def merge_actions(cls):
+    """ Actions of `cls` and its base classes """
+    actions = dict(cls.__dict__.get('__ptahcms_actions__', None) or ())
 
     # get actions from parents
     mro = inspect.getmro(cls)
@@ -84,4 +232,142 @@ def build_class_actions(cls):
                 if name not in actions:
                     actions[name] = action
 
-    cls.__ptahcms_actions__ = actions
+    return actions
+
+
+_action_tables = weakref.WeakKeyDictionary()
+
+def class_actions(cls):
+    """ :py:class:`ActionTable` of `cls`. Tables are built by type
+    registration, table of other classes is built on first use """
+    table = _action_tables.get(cls)
+    if table is None:
+        _action_tables[cls] = table = ActionTable(merge_actions(cls))
+    return table
+
+
+def filter_permitted(items, permission):
+    """ Returns items with `permission` for current principal.
+    Effective acl and local roles of items parent are computed once,
+    for every item only its own `__acl__`, `__local_roles__` and `__owner__`
+    are checked. Result is same as :py:func:`ptah.check_permission` for
+    every item. If `ptah.check_permission` is replaced or custom
+    authorization policy is used, permission is checked for every item.
+
+    :param items: Sequence of content items
+    :param permission: Permission
+    """
+    items = list(items)
+
+    if not permission or permission == ptah.NO_PERMISSION_REQUIRED:
+        return items
+    if permission == ptah.NOT_ALLOWED:
+        return []
+
+    userid = ptah.auth_service.get_effective_userid()
+    if userid == ptah.SUPERUSER_URI:
+        return items
+
+    registry = get_current_registry()
+    if custom_security(registry):
+        return [item for item in items
+                if ptah.check_permission(permission, item)]
+
+    principals = set((ptah.Everyone.id,))
+    if userid is not None:
+        principals.update((ptah.Authenticated.id, userid))
+
+    provider_roles, providers = roles_providers(registry, userid)
+
+    parents = {}
+    result = []
+    for item in items:
+        parent = getattr(item, '__parent__', None)
+        if id(parent) not in parents:
+            parents[id(parent)] = _lineage_security(parent, userid, permission)
+
+        roles, aces = parents[id(parent)]
+
+        item_principals = principals
+        if userid is not None:
+            item_principals = principals | roles | provider_roles
+
+            if ptah.IOwnersAware.providedBy(item) and \
+                    userid == item.__owner__:
+                item_principals.add(ptah.Owner.id)
+
+            if ptah.ILocalRolesAware.providedBy(item) and \
+                    item.__local_roles__:
+                item_principals.update(item.__local_roles__.get(userid, ()))
+
+            for provider in providers:
+                item_principals.update(provider(item, userid, registry))
+
+        for action, principal in _acl_entries(item, permission) + aces:
+            if principal in item_principals:
+                if action == Allow:
+                    result.append(item)
+                break
+
+    return result
+
+
+def custom_security(registry):
+    """ `ptah.check_permission` is replaced or custom authorization
+    policy is used, acls can't be evaluated directly """
+    policy = registry.queryUtility(IAuthorizationPolicy)
+    return ptah.check_permission is not ptah_check_permission or \
+        type(policy) not in (ACLAuthorizationPolicy, PtahAuthorizationPolicy)
+
+
+def roles_providers(registry, userid):
+    """ Roles of context independent providers (`ptah.default_roles`
+    setting) and list of other roles providers """
+    roles = set()
+    providers = []
+    for provider in config.get_cfg_storage(
+            ID_ROLES_PROVIDER, registry).values():
+        if provider is ptah_default_roles:
+            if userid is not None:
+                roles.update(provider(None, userid, registry))
+        else:
+            providers.append(provider)
+
+    return roles, providers
+
+
+def _lineage_security(context, userid, permission):
+    """ Local roles of `userid` and acl entries for `permission`
+    of `context` and its parents """
+    roles = set()
+    aces = []
+    for location in lineage(context):
+        if userid is not None and ptah.ILocalRolesAware.providedBy(location):
+            local_roles = location.__local_roles__
+            if local_roles:
+                roles.update(local_roles.get(userid, ()))
+
+        aces.extend(_acl_entries(location, permission))
+
+    return roles, aces
+
+
+def _acl_entries(location, permission):
+    """ `(action, principal)` acl entries of location for `permission` """
+    try:
+        acl = location.__acl__
+    except AttributeError:
+        return []
+
+    return _permission_entries(acl, permission)
+
+
+def _permission_entries(acl, permission):
+    aces = []
+    for action, principal, permissions in acl:
+        if not is_nonstr_iter(permissions):
+            permissions = (permissions,)
+        if permission in permissions:
+            aces.append((action, principal))
+
+    return aces
@@ -6,3 +6,85 @@ _ = translationstring.TranslationStringFactory('ptahcms')
 
 CFG_ID_CMS = 'ptahcms'
 
+
+ptah.register_settings(
+    CFG_ID_CMS,
+
+    form.IntegerField(
+        'traverser_cache_size',
+        title = _('Traverser cache size'),
+        description = _('Maximum number of resolved request paths kept '
+                        'by content traverser, 0 disables cache.'),
+        default = 0),
+
+    form.IntegerField(
+        'traverser_cache_ttl',
+        title = _('Traverser cache ttl'),
+        description = _('Time in seconds after which cached request '
+                        'path is resolved again.'),
+        default = 300),
+
+    form.ChoiceField(
+        'children_loading',
+        title = _('Children loading'),
+        description = _('Loading strategy of node children for cms '
+                        'queries ("select", "joined", "subquery").'),
+        vocabulary = form.Vocabulary('select', 'joined', 'subquery'),
+        default = 'select'),
+
+    form.IntegerField(
+        'blob_chunk_size',
+        title = _('Blob chunk size'),
+        description = _('Size in bytes of blob data chunks, '
+                        '0 stores blob data in one column.'),
+        default = 262144),
+
+    form.BoolField(
+        'blob_dedup',
+        title = _('Blob deduplication'),
+        description = _('Store same blob data only once.'),
+        default = False),
+
+    form.TextField(
+        'blob_fs_path',
+        title = _('Blob files path'),
+        description = _('Directory of file system blob storage.'),
+        default = ''),
+
+    form.BoolField(
+        'rest_pretty_json',
+        title = _('Pretty rest output'),
+        description = _('Indent json output of rest api.'),
+        default = False),
+
+    form.ChoiceField(
+        'rest_json_backend',
+        title = _('Rest json encoder'),
+        description = _('Json encoder of rest api ("auto", "json", '
+                        '"orjson"), "auto" uses orjson if it is installed.'),
+        vocabulary = form.Vocabulary('auto', 'json', 'orjson'),
+        default = 'auto'),
+
+    form.IntegerField(
+        'rest_page_size',
+        title = _('Rest page size'),
+        description = _('Maximum number of items in container contents '
+                        'listing of rest api.'),
+        default = 1000),
+
+    form.IntegerField(
+        'rest_token_cache_size',
+        title = _('Rest token cache size'),
+        description = _('Maximum number of verified rest auth tokens '
+                        'kept in memory, 0 disables cache.'),
+        default = 1000),
+
+    form.IntegerField(
+        'rest_token_cache_ttl',
+        title = _('Rest token cache ttl'),
+        description = _('Time in seconds after which cached rest auth '
+                        'token is verified again.'),
+        default = 300),
+
+    title = _('CMS settings'),
+)
@@ -80,6 +80,44 @@ class TestBlob(PtahTestCase):
         blob = ptahcms.blob_storage.getByParent(content_uri)
         self.assertEqual(blob.__uri__, blob_uri)
 
+    def test_blob_list_by_parent(self):
+        import ptahcms
+
+        class MyContent(ptahcms.Node):
+            __name__ = ''
+            __mapper_args__ = {'polymorphic_identity': 'mycontent'}
+            __uri_factory__ = ptah.UriFactory('test')
+
+        content1 = MyContent()
+        content2 = MyContent()
+        ptah.get_session().add(content1)
+        ptah.get_session().add(content2)
+
+        blob1 = ptahcms.blob_storage.add(
+            BytesIO(bytes_('blob data','utf-8')), content1,
+            filename='test1.txt', mimetype='text/plain')
+        blob2 = ptahcms.blob_storage.add(
+            BytesIO(bytes_('blob','utf-8')), content1, filename='test2.txt')
+        blob3 = ptahcms.blob_storage.add(
+            BytesIO(bytes_('data','utf-8')), content2, filename='test3.txt')
+        ptahcms.blob_storage.add(BytesIO(bytes_('data','utf-8')))
+
+        info = ptahcms.blob_storage.listByParent(content1.__uri__)
+        self.assertEqual([i['__uri__'] for i in info],
+                         [blob1.__uri__, blob2.__uri__])
+        self.assertEqual(info[0]['__parent_uri__'], content1.__uri__)
+        self.assertEqual(info[0]['filename'], 'test1.txt')
+        self.assertEqual(info[0]['mimetype'], 'text/plain')
+        self.assertEqual(info[0]['size'], 9)
+        self.assertEqual(info[0]['hash'], blob1.hash)
+
+        info = ptahcms.blob_storage.listByParent(
+            [content1.__uri__, content2.__uri__], chunksize=1)
+        self.assertEqual([i['__uri__'] for i in info],
+                         [blob1.__uri__, blob2.__uri__, blob3.__uri__])
+
+        self.assertEqual(ptahcms.blob_storage.listByParent([]), [])
+
     def test_blob_write(self):
         import ptahcms
 
@@ -103,10 +141,51 @@ class TestBlob(PtahTestCase):
         response = blobData(blob, self.request)
         self.assertEqual(response.body, bytes_('blob data','utf-8'))
         self.assertEqual(
-            response.headerlist,
+            response.headerlist[:3],
             [('Content-Type', bytes_('text/plain')),
              ('Content-Disposition', bytes_('filename="test.txt"','utf-8')),
              ('Content-Length', '9')])
+        self.assertEqual(response.accept_ranges, 'bytes')
+        self.assertEqual(response.etag, blob.hash)
+        self.assertIsNotNone(response.last_modified)
+
+    def test_blob_rest_data_conditional(self):
+        import ptahcms
+        from webob import Request
+        from ptahcms.rest import blobData
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_chunk_size'] = 4
+
+        blob = ptahcms.blob_storage.add(
+            BytesIO(bytes_('blob data','utf-8')), mimetype='text/plain')
+        cfg['blob_chunk_size'] = 262144
+
+        req = Request.blank('/', if_none_match=blob.hash)
+        resp = req.get_response(blobData(blob, self.request))
+        self.assertEqual(resp.status_int, 304)
+
+        req = Request.blank('/', if_modified_since=blob.modified)
+        resp = req.get_response(blobData(blob, self.request))
+        self.assertEqual(resp.status_int, 304)
+
+        loaded = []
+        orig_iterdata = blob.iterdata
+        def iterdata(start=0, stop=None):
+            loaded.append((start, stop))
+            return orig_iterdata(start, stop)
+        blob.iterdata = iterdata
+
+        req = Request.blank('/', range=(5, 7))
+        resp = req.get_response(blobData(blob, self.request))
+        self.assertEqual(resp.status_int, 206)
+        self.assertEqual(resp.body, bytes_('da','utf-8'))
+        self.assertEqual(loaded, [(5, 7)])
+
+        self.assertEqual(list(orig_iterdata(3, 9)),
+                         [bytes_('b','utf-8'), bytes_(' dat','utf-8'),
+                          bytes_('a','utf-8')])
 
     def test_blob_rest_data_headers_unicode(self):
         import ptahcms
@@ -119,6 +198,381 @@ class TestBlob(PtahTestCase):
         response = blobData(blob, self.request)
 
         headers = response.headers
-        for hdr in headers:
-            if hdr.lower() != 'content-length':
-                self.assertTrue(isinstance(headers[hdr], binary_type))
+        for hdr in ('Content-Type', 'Content-Disposition'):
+            self.assertTrue(isinstance(headers[hdr], binary_type))
+
+    def test_blob_chunked(self):
+        import ptahcms
+        from ptahcms.blob import BlobChunk
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_chunk_size'] = 4
+
+        blob = ptahcms.blob_storage.add(BytesIO(bytes_('blob data','utf-8')))
+        blob_uri = blob.__uri__
+        payload_id = blob.payload_id
+        transaction.commit()
+
+        blob = ptah.resolve(blob_uri)
+        self.assertEqual(blob.size, 9)
+        self.assertEqual(blob.chunksize, 4)
+        self.assertEqual(list(blob.iterdata()),
+                         [bytes_('blob','utf-8'), bytes_(' dat','utf-8'),
+                          bytes_('a','utf-8')])
+        self.assertEqual(blob.read(), bytes_('blob data','utf-8'))
+
+        Session = ptah.get_session()
+        chunks = lambda id: \
+            Session.query(BlobChunk).filter_by(payload_id=id).count()
+        self.assertEqual(chunks(payload_id), 3)
+
+        blob.write(bytes_('new data','utf-8'))
+        self.assertEqual(blob.read(), bytes_('new data','utf-8'))
+        self.assertEqual(chunks(payload_id), 0)
+        payload_id = blob.payload_id
+        self.assertEqual(chunks(payload_id), 2)
+
+        Session.delete(blob)
+        Session.flush()
+        self.assertEqual(chunks(payload_id), 0)
+
+        cfg['blob_chunk_size'] = 0
+        blob = ptahcms.blob_storage.add(BytesIO(bytes_('blob data','utf-8')))
+        self.assertEqual(blob.chunksize, 0)
+        self.assertEqual(blob.data, bytes_('blob data','utf-8'))
+        self.assertEqual(list(blob.iterdata()), [bytes_('blob data','utf-8')])
+
+        cfg['blob_chunk_size'] = 262144
+        transaction.commit()
+
+    def test_blob_chunked_truncated(self):
+        import ptahcms
+        from ptahcms.blob import BlobChunk
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_chunk_size'] = 4
+        self.addCleanup(cfg.__setitem__, 'blob_chunk_size', 262144)
+
+        blob = ptahcms.blob_storage.add(BytesIO(bytes_('blob data','utf-8')))
+
+        Session = ptah.get_session()
+        Session.query(BlobChunk).filter_by(
+            payload_id=blob.payload_id, seq=1).delete()
+
+        data = blob.iterdata()
+        self.assertEqual(next(data), bytes_('blob','utf-8'))
+        self.assertRaises(ptahcms.Error, next, data)
+        self.assertRaises(ptahcms.Error, blob.read)
+
+    def test_blob_replace_remove(self):
+        import ptahcms
+        from ptahcms.blob import BlobPayload
+
+        blob = ptahcms.blob_storage.add(
+            BytesIO(bytes_('blob data','utf-8')), filename='test.txt')
+        blob_uri = blob.__uri__
+        payload_id = blob.payload_id
+        transaction.commit()
+
+        blob = ptahcms.blob_storage.replace(
+            blob_uri, BytesIO(bytes_('new data','utf-8')), filename='new.txt')
+        self.assertEqual(blob.filename, 'new.txt')
+        self.assertEqual(blob.read(), bytes_('new data','utf-8'))
+
+        Session = ptah.get_session()
+        self.assertIsNone(Session.query(BlobPayload).get(payload_id))
+        payload_id = blob.payload_id
+        transaction.commit()
+
+        ptahcms.blob_storage.remove(blob_uri)
+        self.assertIsNone(ptah.resolve(blob_uri))
+        self.assertIsNone(Session.query(BlobPayload).get(payload_id))
+
+        self.assertRaises(ptahcms.NotFound,
+                          ptahcms.blob_storage.remove, blob_uri)
+        self.assertRaises(ptahcms.NotFound, ptahcms.blob_storage.replace,
+                          blob_uri, BytesIO(bytes_('data','utf-8')))
+
+    def test_blob_writer(self):
+        import ptahcms
+        from ptahcms.blob import BlobPayload
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_chunk_size'] = 4
+
+        blob = ptahcms.blob_storage.create()
+        with blob.writer() as writer:
+            writer.write(bytes_('blob','utf-8'))
+            writer.write(bytes_(' da','utf-8'))
+            writer.write(bytes_('ta','utf-8'))
+
+        self.assertEqual(blob.size, 9)
+        self.assertEqual(list(blob.iterdata()),
+                         [bytes_('blob','utf-8'), bytes_(' dat','utf-8'),
+                          bytes_('a','utf-8')])
+
+        # existing chunks are not rewritten
+        payload_id = blob.payload_id
+        with blob.writer(append=True) as writer:
+            writer.write(bytes_(' appended','utf-8'))
+        self.assertEqual(blob.read(), bytes_('blob data appended','utf-8'))
+        self.assertEqual(blob.size, 18)
+        self.assertEqual(blob.payload_id, payload_id)
+        self.assertIsNone(blob.hash)
+
+        # failed append restores data
+        try:
+            with blob.writer(append=True) as writer:
+                writer.write(bytes_(' more data','utf-8'))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(blob.read(), bytes_('blob data appended','utf-8'))
+
+        # failed write keeps previous data
+        Session = ptah.get_session()
+        payloads = Session.query(BlobPayload).count()
+        try:
+            with blob.writer() as writer:
+                writer.write(bytes_('new data','utf-8'))
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(Session.query(BlobPayload).count(), payloads)
+        self.assertEqual(blob.read(), bytes_('blob data appended','utf-8'))
+
+        cfg['blob_chunk_size'] = 262144
+        transaction.commit()
+
+    def test_blob_dedup(self):
+        import ptahcms
+        from ptahcms.blob import Blob, BlobPayload, gc_payloads
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_dedup'] = True
+
+        blob1 = ptahcms.blob_storage.add(BytesIO(bytes_('blob data','utf-8')))
+        blob2 = ptahcms.blob_storage.add(BytesIO(bytes_('blob data','utf-8')))
+        blob3 = ptahcms.blob_storage.add(BytesIO(bytes_('other','utf-8')))
+        cfg['blob_dedup'] = False
+
+        Session = ptah.get_session()
+        payload = Session.query(BlobPayload).get(blob1.payload_id)
+        self.assertEqual(blob1.payload_id, blob2.payload_id)
+        self.assertNotEqual(blob1.payload_id, blob3.payload_id)
+        self.assertEqual(payload.refs, 2)
+        self.assertEqual(payload.hash, blob2.hash)
+        self.assertEqual(Session.query(BlobPayload).count(), 2)
+        self.assertEqual(blob2.read(), bytes_('blob data','utf-8'))
+
+        payload_id = blob1.payload_id
+        Session.delete(blob1)
+        Session.flush()
+        Session.expire_all()
+        self.assertEqual(Session.query(BlobPayload).get(payload_id).refs, 1)
+        self.assertEqual(gc_payloads(), 0)
+
+        # set-based delete doesn't release payload
+        Session.execute(Blob.__table__.delete().where(
+            Blob.__table__.c.id == blob2.__id__))
+        Session.expire_all()
+        self.assertEqual(gc_payloads(), 1)
+        self.assertIsNone(Session.query(BlobPayload).get(payload_id))
+        self.assertEqual(Session.query(BlobPayload).count(), 1)
+
+
+class TestFSBlob(PtahTestCase):
+
+    _includes = ('ptahcms',)
+
+    def setUp(self):
+        import tempfile
+        from ptahcms.settings import CFG_ID_CMS
+        super(TestFSBlob, self).setUp()
+
+        self.dir = tempfile.mkdtemp()
+        self.cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        self.cfg['blob_fs_path'] = self.dir
+
+    def tearDown(self):
+        import shutil
+        self.cfg['blob_fs_path'] = ''
+        shutil.rmtree(self.dir)
+        super(TestFSBlob, self).tearDown()
+
+    def test_fsblob(self):
+        import os, ptahcms
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')),
+            filename='test.txt', mimetype='text/plain')
+        self.assertTrue(ptahcms.IFSBlob.providedBy(blob))
+        self.assertTrue(blob.__uri__.startswith('blob-fs:'))
+
+        id = blob.__uri__.split(':', 1)[1]
+        self.assertEqual(blob.path,
+                         os.path.join(self.dir, id[:2], id[2:4], id))
+        self.assertEqual(blob.read(), bytes_('blob data','utf-8'))
+
+        # file is stored on commit
+        path = blob.path
+        self.assertFalse(os.path.exists(path))
+
+        blob_uri = blob.__uri__
+        transaction.commit()
+        self.assertTrue(os.path.isfile(path))
+
+        blob = ptah.resolve(blob_uri)
+        self.assertEqual(blob.size, 9)
+        self.assertEqual(blob.filename, 'test.txt')
+        self.assertEqual(blob.read(), bytes_('blob data','utf-8'))
+
+        blob.write(bytes_('new data','utf-8'))
+        self.assertEqual(blob.size, 8)
+        self.assertEqual(list(blob.iterdata()), [bytes_('new data','utf-8')])
+
+    def test_fsblob_writer(self):
+        import os, ptahcms
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')))
+        blob_uri = blob.__uri__
+        transaction.commit()
+
+        blob = ptah.resolve(blob_uri)
+        with blob.writer(append=True) as writer:
+            writer.write(bytes_(' appended','utf-8'))
+        self.assertEqual(blob.read(), bytes_('blob data appended','utf-8'))
+        self.assertEqual(blob.size, 18)
+        self.assertIsNone(blob.hash)
+
+        # only appended data is staged, file is changed on commit
+        with open(blob.path, 'rb') as f:
+            self.assertEqual(f.read(), bytes_('blob data','utf-8'))
+        self.assertEqual(list(blob.iterdata(7, 12)),
+                         [bytes_('ta','utf-8'), bytes_(' ap','utf-8')])
+
+        transaction.commit()
+        blob = ptah.resolve(blob_uri)
+        with open(blob.path, 'rb') as f:
+            self.assertEqual(f.read(), bytes_('blob data appended','utf-8'))
+
+        try:
+            with blob.writer() as writer:
+                writer.write(bytes_('new data','utf-8'))
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(blob.read(), bytes_('blob data appended','utf-8'))
+
+        blob = ptahcms.blobfs_storage.replace(
+            blob.__uri__, BytesIO(bytes_('new data','utf-8')))
+        self.assertEqual(blob.read(), bytes_('new data','utf-8'))
+
+        transaction.commit()
+        blob = ptah.resolve(blob_uri)
+        self.assertEqual(blob.read(), bytes_('new data','utf-8'))
+        self.assertEqual(os.listdir(os.path.dirname(blob.path)),
+                         [os.path.basename(blob.path)])
+
+    def test_fsblob_abort(self):
+        import os, ptahcms
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')))
+        path = blob.path
+        transaction.abort()
+
+        # file of new blob is not stored
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')))
+        blob_uri = blob.__uri__
+        transaction.commit()
+
+        # previous data is kept
+        blob = ptah.resolve(blob_uri)
+        blob.write(bytes_('new data','utf-8'))
+        self.assertEqual(blob.read(), bytes_('new data','utf-8'))
+        transaction.abort()
+
+        blob = ptah.resolve(blob_uri)
+        self.assertEqual(blob.read(), bytes_('blob data','utf-8'))
+        self.assertEqual(os.listdir(os.path.dirname(blob.path)),
+                         [os.path.basename(blob.path)])
+
+    def test_fsblob_rest_data(self):
+        import ptahcms
+        from pyramid.response import FileIter
+        from ptahcms.rest import blobData
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')),
+            filename='test.txt', mimetype='text/plain')
+
+        response = blobData(blob, self.request)
+        self.assertIsInstance(response.app_iter, FileIter)
+        self.assertEqual(response.content_length, 9)
+        self.assertEqual(response.body, bytes_('blob data','utf-8'))
+
+        wrapped = []
+        def file_wrapper(f, block_size):
+            wrapped.append(f)
+            return FileIter(f, block_size)
+
+        self.request.environ['wsgi.file_wrapper'] = file_wrapper
+        response = blobData(blob, self.request)
+        self.assertEqual(len(wrapped), 1)
+        self.assertEqual(response.body, bytes_('blob data','utf-8'))
+
+    def test_fsblob_delete(self):
+        import os, ptahcms
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')))
+        blob_uri = blob.__uri__
+        path = blob.path
+        transaction.commit()
+
+        ptah.get_session().delete(ptah.resolve(blob_uri))
+        ptah.get_session().flush()
+        self.assertTrue(os.path.exists(path))
+
+        transaction.commit()
+        self.assertFalse(os.path.exists(path))
+
+    def test_fsblob_delete_not_configured(self):
+        import os, ptahcms
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')))
+        blob_uri = blob.__uri__
+        path = blob.path
+        transaction.commit()
+
+        # blob rows are removed without storage path
+        self.cfg['blob_fs_path'] = ''
+        ptah.get_session().delete(ptah.resolve(blob_uri))
+        ptah.get_session().flush()
+        transaction.commit()
+
+        self.assertTrue(ptah.resolve(blob_uri) is None)
+        self.assertTrue(os.path.exists(path))
+
+    def test_fsblob_empty(self):
+        import ptahcms
+        from ptahcms.rest import blobData
+
+        blob = ptahcms.blobfs_storage.create()
+        self.assertEqual(blob.open().read(), binary_type())
+
+        response = blobData(blob, self.request)
+        self.assertEqual(response.body, binary_type())
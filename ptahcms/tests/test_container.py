@@ -108,6 +108,66 @@ class TestContainer(PtahTestCase):
         self.assertEqual([c.__uri__ for c in container.values()],
                          [c2.__uri__])
 
+    def test_container_page(self):
+        from datetime import datetime
+
+        container = self.Container(__name__ = 'container',
+                                   __path__ = '/container/')
+        for idx, name in enumerate(('c', 'a', 'd', 'b', 'e')):
+            content = self.Content(title=name)
+            container[name] = content
+            content.created = datetime(2012, 1, 10 - idx)
+
+        values, cursor = container.page(2)
+        self.assertEqual([c.__name__ for c in values], ['a', 'b'])
+        self.assertEqual(cursor, 'b')
+        self.assertIs(values[0].__parent__, container)
+
+        values, cursor = container.page(2, cursor)
+        self.assertEqual([c.__name__ for c in values], ['c', 'd'])
+
+        values, cursor = container.page(2, cursor)
+        self.assertEqual([c.__name__ for c in values], ['e'])
+        self.assertIsNone(cursor)
+
+        values, cursor = container.page(3, order='created')
+        self.assertEqual([c.__name__ for c in values], ['e', 'b', 'd'])
+        self.assertEqual(cursor, '2012-01-08T00:00:00.000000/d')
+
+        values, cursor = container.page(3, cursor, order='created')
+        self.assertEqual([c.__name__ for c in values], ['a', 'c'])
+
+        values, cursor = container.page(2, order='created', reverse=True)
+        self.assertEqual([c.__name__ for c in values], ['c', 'a'])
+
+        self.assertEqual(
+            [c.__name__ for c in container.itervalues(chunksize=2)],
+            ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(
+            [c.__name__ for c in container.itervalues(after='c')],
+            ['d', 'e'])
+
+        self.assertRaises(ValueError, container.page, 2, order='unknown')
+
+    def test_container_contains_free_name(self):
+        container = self.Container(__name__ = 'container',
+                                   __path__ = '/container/')
+        container['test'] = self.Content()
+        container['test-1'] = self.Content()
+        container['test-3'] = self.Content()
+        container['test_2'] = self.Content()
+        container['other.html'] = self.Content()
+
+        self.assertTrue('test' in container)
+        self.assertTrue('test_2' in container)
+        self.assertFalse('test-2' in container)
+        self.assertFalse('unknown' in container)
+
+        self.assertEqual(container.free_name('test'), 'test-2')
+        self.assertEqual(container.free_name('other'), 'other')
+        self.assertEqual(container.free_name('other', '.html'), 'other-1.html')
+        self.assertEqual(container.free_name('test', '.html'), 'test.html')
+
     def test_container_simple_move(self):
         container = self.Container(__name__ = 'container',
                                    __path__ = '/container/')
@@ -293,6 +353,44 @@ class TestContainer(PtahTestCase):
         self.assertEqual(content.__path__,
                          '/container/new-folder/folder2/content/')
 
+    def test_container_rename_subtree_loaded(self):
+        container = self.Container(__name__ = 'container',
+                                   __path__ = '/container/')
+        folder1 = self.Container(title='Folder1')
+        folder2 = self.Container(title='Folder2')
+        content = self.Content(title='Content')
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.add(folder1)
+        Session.add(folder2)
+        Session.add(content)
+        Session.flush()
+
+        container['fold_1'] = folder1
+        container['fold-1'] = folder2
+        folder1['content'] = content
+
+        content_uri = content.__uri__
+        container_uri = container.__uri__
+        folder2_uri = folder2.__uri__
+        transaction.commit()
+
+        container = ptah.resolve(container_uri)
+        content = ptah.resolve(content_uri)
+        self.assertEqual(content.__path__, '/container/fold_1/content/')
+
+        container['new-folder'] = container['fold_1']
+        self.assertEqual(content.__path__,
+                         '/container/new-folder/content/')
+        transaction.commit()
+
+        content = ptah.resolve(content_uri)
+        folder2 = ptah.resolve(folder2_uri)
+        self.assertEqual(content.__path__,
+                         '/container/new-folder/content/')
+        self.assertEqual(folder2.__path__, '/container/fold-1/')
+
     def test_container_move_self_recursevly(self):
         container = self.Container(__name__ = 'container',
                                    __path__ = '/container/')
@@ -371,6 +469,189 @@ class TestContainer(PtahTestCase):
         self.assertTrue(ptah.resolve(content_uri) is None)
         self.assertTrue(ptah.resolve(folder_uri) is None)
 
+    def test_container_delete_bulk(self):
+        container = self.Container(__name__='container', __path__='/container/')
+        folder = self.Container(title='Folder')
+        subfolder = self.Container(title='Subfolder')
+        content = self.Content(title='Content')
+        sibling = self.Content(title='Sibling')
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.add(folder)
+        Session.add(subfolder)
+        Session.add(content)
+        Session.add(sibling)
+        Session.flush()
+
+        container['folder'] = folder
+        container['folder_'] = sibling
+        folder['subfolder'] = subfolder
+        subfolder['content'] = content
+
+        content_uri = content.__uri__
+        container_uri = container.__uri__
+        folder_uri = folder.__uri__
+        subfolder_uri = subfolder.__uri__
+        sibling_uri = sibling.__uri__
+        transaction.commit()
+
+        events = []
+        def handler(ev):
+            events.append((ev.__class__, ev.object.__uri__))
+
+        def uri_handler(ev):
+            events.append((ev.__class__, ev.uri))
+
+        self.config.add_subscriber(handler, ptah.events.ContentDeletingEvent)
+        self.config.add_subscriber(uri_handler, ptah.events.UriInvalidateEvent)
+
+        self.Container.__bulk_delete__ = True
+        self.addCleanup(setattr, self.Container, '__bulk_delete__', False)
+
+        container = ptah.resolve(container_uri)
+        del container['folder']
+        self.assertEqual(container.keys(), ['folder_'])
+        transaction.commit()
+
+        self.assertIn(
+            (ptah.events.ContentDeletingEvent, folder_uri), events)
+        self.assertNotIn(
+            (ptah.events.ContentDeletingEvent, content_uri), events)
+        self.assertIn((ptah.events.UriInvalidateEvent, content_uri), events)
+        self.assertIn((ptah.events.UriInvalidateEvent, subfolder_uri), events)
+
+        self.assertTrue(ptah.resolve(content_uri) is None)
+        self.assertTrue(ptah.resolve(subfolder_uri) is None)
+        self.assertTrue(ptah.resolve(folder_uri) is None)
+        self.assertEqual(ptah.resolve(sibling_uri).__uri__, sibling_uri)
+
+    def test_container_delete_bulk_fsblob(self):
+        import os, shutil, tempfile
+        import ptahcms
+        from io import BytesIO
+        from pyramid.compat import bytes_
+        from ptahcms.container import delete_subtree
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_fs_path'] = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cfg['blob_fs_path'])
+        self.addCleanup(cfg.__setitem__, 'blob_fs_path', '')
+
+        container = self.Container(__name__='container', __path__='/container/')
+        container['folder'] = self.Container(title='Folder')
+        ptah.get_session().add(container)
+        ptah.get_session().flush()
+
+        blob = ptahcms.blobfs_storage.add(
+            BytesIO(bytes_('blob data','utf-8')), parent=container['folder'])
+        container_uri = container.__uri__
+        path = blob.path
+        transaction.commit()
+        self.assertTrue(os.path.exists(path))
+
+        container = ptah.resolve(container_uri)
+        delete_subtree(container['folder'])
+        self.assertTrue(os.path.exists(path))
+
+        transaction.commit()
+        self.assertFalse(os.path.exists(path))
+
+    def test_container_delete_bulk_blob_payload(self):
+        import ptahcms
+        from io import BytesIO
+        from pyramid.compat import bytes_
+        from ptahcms.blob import BlobPayload
+        from ptahcms.container import delete_subtree
+        from ptahcms.settings import CFG_ID_CMS
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['blob_dedup'] = True
+        self.addCleanup(cfg.__setitem__, 'blob_dedup', False)
+
+        container = self.Container(__name__='container', __path__='/container/')
+        container['folder'] = self.Container(title='Folder')
+        container['folder2'] = self.Container(title='Folder2')
+        ptah.get_session().add(container)
+        ptah.get_session().flush()
+
+        data = bytes_('blob data','utf-8')
+        shared = ptahcms.blob_storage.add(
+            BytesIO(data), parent=container['folder'])
+        other = ptahcms.blob_storage.add(
+            BytesIO(data), parent=container['folder2'])
+        own = ptahcms.blob_storage.add(
+            BytesIO(bytes_('other data','utf-8')), parent=container['folder'])
+
+        shared_id, own_id = shared.payload_id, own.payload_id
+        self.assertEqual(other.payload_id, shared_id)
+
+        # payloads of deleted blobs are released
+        delete_subtree(container['folder'])
+
+        Session = ptah.get_session()
+        Session.expire_all()
+        self.assertEqual(Session.query(BlobPayload).get(shared_id).refs, 1)
+        self.assertIsNone(Session.query(BlobPayload).get(own_id))
+
+    def test_container_delete_bulk_events(self):
+        import ptahcms
+        from ptahcms.container import delete_subtree
+
+        container = self.Container(__name__='container', __path__='/container/')
+        folder = self.Container(title='Folder')
+        content = self.Content(title='Content')
+
+        container['folder'] = folder
+        folder['content'] = content
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.flush()
+
+        events = []
+        def handler(ev):
+            events.append(ev.object.__uri__)
+
+        self.config.add_subscriber(handler, ptah.events.ContentDeletingEvent)
+
+        delete_subtree(folder, True)
+        self.assertEqual(events, [content.__uri__])
+        self.assertEqual(container.keys(), [])
+        self.assertRaises(ptahcms.Error, delete_subtree, self.Content())
+
+    def test_container_delete_bulk_chunks(self):
+        from ptahcms.container import delete_subtree
+
+        container = self.Container(__name__='container', __path__='/container/')
+        folder = self.Container(title='Folder')
+        container['folder'] = folder
+        for name in ('a', 'b', 'c'):
+            folder[name] = self.Content(title=name)
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.flush()
+
+        uris = sorted(c.__uri__ for c in folder.values())
+
+        deleting = []
+        invalidated = []
+        def handler(ev):
+            deleting.append(ev.object.__uri__)
+
+        def uri_handler(ev):
+            invalidated.append(ev.uri)
+
+        self.config.add_subscriber(handler, ptah.events.ContentDeletingEvent)
+        self.config.add_subscriber(uri_handler, ptah.events.UriInvalidateEvent)
+
+        # every uri is notified once
+        delete_subtree(folder, True, chunksize=1)
+        self.assertEqual(sorted(deleting), uris)
+        self.assertEqual(sorted(invalidated), uris)
+
     def test_container_setitem_parent_not_node(self):
         container = self.Container(__name__='container', __path__='/container/')
         content = self.Content(title='Content')
@@ -417,6 +698,94 @@ class TestContainer(PtahTestCase):
 
         tinfo.permission = ptah.NOT_ALLOWED
 
+    def test_container_batchdelete(self):
+        import ptahcms
+
+        container = self.Container(__name__='container', __path__='/container/')
+        folder = self.Container(title='Folder')
+        content = self.Content(title='Content')
+        other = self.Content(title='Other')
+
+        container['folder'] = folder
+        container['other'] = other
+        folder['content'] = content
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.flush()
+
+        uris = [folder.__uri__, other.__uri__]
+        content_uri = content.__uri__
+
+        self.assertRaises(
+            ptahcms.NotFound, container.batchdelete, uris + ['unknown'])
+        self.assertRaises(
+            ptahcms.NotFound, container.batchdelete, [content_uri])
+        self.assertEqual(container.keys(), ['folder', 'other'])
+
+        allow = [False]
+        def check_permission(permission, content, r=None, t=False):
+            return allow[0]
+
+        orig_check_permission = ptah.check_permission
+        ptah.check_permission = check_permission
+        try:
+            self.assertRaises(
+                ptahcms.Forbidden, container.batchdelete, uris)
+            self.assertEqual(container.keys(), ['folder', 'other'])
+
+            allow[0] = True
+            self.assertEqual(container.batchdelete(uris + uris), uris)
+        finally:
+            ptah.check_permission = orig_check_permission
+
+        self.assertEqual(container.keys(), [])
+        transaction.commit()
+
+        self.assertTrue(ptah.resolve(content_uri) is None)
+
+    def test_container_batchdelete_events(self):
+        container = self.Container(__name__='container', __path__='/container/')
+        for name in ('folder', 'bulk', 'bulk_events'):
+            container[name] = self.Container(title=name)
+            container[name]['content'] = self.Content(title='Content')
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.flush()
+
+        container['bulk'].__bulk_delete__ = True
+        container['bulk_events'].__bulk_delete__ = True
+        container['bulk_events'].__bulk_delete_events__ = True
+
+        uris = dict((name, (container[name].__uri__,
+                            container[name]['content'].__uri__))
+                    for name in ('folder', 'bulk', 'bulk_events'))
+
+        events = []
+        def handler(ev):
+            events.append(ev.object.__uri__)
+
+        self.config.add_subscriber(handler, ptah.events.ContentDeletingEvent)
+
+        orig_check_permission = ptah.check_permission
+        ptah.check_permission = lambda p, c, r=None, t=False: True
+        try:
+            container.batchdelete([uris['folder'][0], uris['bulk'][0],
+                                   uris['bulk_events'][0]])
+        finally:
+            ptah.check_permission = orig_check_permission
+
+        self.assertEqual(container.keys(), [])
+
+        # non-bulk container notifies descendants same way as __delitem__
+        self.assertIn(uris['folder'][0], events)
+        self.assertIn(uris['folder'][1], events)
+        self.assertIn(uris['bulk'][0], events)
+        self.assertNotIn(uris['bulk'][1], events)
+        self.assertIn(uris['bulk_events'][0], events)
+        self.assertIn(uris['bulk_events'][1], events)
+
     def test_container_info(self):
         container = self.Container(__name__='container', __path__='/container/')
 
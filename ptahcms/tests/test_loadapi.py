@@ -55,6 +55,89 @@ class TestLoadApi(PtahTestCase):
         content = ptahcms.load(c_uri)
         self.assertEqual(content.__parent__.__uri__, co_uri)
 
+    def test_loadapi_load_parents_by_path(self):
+        container = Container(__name__='container', __path__='/container/')
+        folder = Container(title='Folder')
+        content = Content(title='Content')
+
+        container['folder'] = folder
+        folder['content'] = content
+
+        c_uri = content.__uri__
+        f_uri = folder.__uri__
+        co_uri = container.__uri__
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.add(folder)
+        Session.add(content)
+        transaction.commit()
+
+        content = ptah.resolve(c_uri)
+        self.assertEqual(sorted(content._load_ancestors().keys()),
+                         sorted([f_uri, co_uri]))
+
+        parents = ptahcms.load_parents(content)
+        self.assertEqual([p.__uri__ for p in parents], [f_uri, co_uri])
+
+    def test_loadapi_resolve_many(self):
+        content = Content(title='Content')
+        container = Container(__name__='container', __path__='/container/')
+
+        c_uri = content.__uri__
+        co_uri = container.__uri__
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.add(content)
+        transaction.commit()
+
+        items = ptahcms.resolve_many(
+            [c_uri, 'type-content:unknown', co_uri, 'unknown', c_uri],
+            chunksize=1)
+
+        self.assertEqual(len(items), 5)
+        self.assertIsInstance(items[0], Content)
+        self.assertIsInstance(items[2], Container)
+        self.assertEqual(items[0].__uri__, c_uri)
+        self.assertEqual(items[2].__uri__, co_uri)
+        self.assertIsNone(items[1])
+        self.assertIsNone(items[3])
+        self.assertIs(items[4], items[0])
+
+        self.assertEqual(ptahcms.resolve_many([]), [])
+
+    def test_loadapi_idmap(self):
+        from ptahcms.node import idmap_get
+
+        content = Content(title='Content')
+        container = Container(__name__='container', __path__='/container/')
+        container['content'] = content
+
+        c_uri = content.__uri__
+        co_uri = container.__uri__
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.add(content)
+        transaction.commit()
+
+        self.assertIsNone(idmap_get(c_uri))
+
+        container = ptah.resolve(co_uri)
+        self.assertIs(idmap_get(co_uri), container)
+
+        # container listing seeds identity map
+        content = container.values()[0]
+        self.assertIs(idmap_get(c_uri), content)
+        self.assertIs(ptah.resolve(c_uri), content)
+
+        # invalidated uri
+        self.registry.notify(ptah.events.UriInvalidateEvent(c_uri))
+        self.assertIsNone(idmap_get(c_uri))
+
+        # nodes from previous session are ignored
+        transaction.commit()
+        self.assertIsNone(idmap_get(co_uri))
+        self.assertIsNot(ptah.resolve(co_uri), container)
+
     def test_loadapi_load_permission(self):
         import ptah
 
@@ -0,0 +1,258 @@
+import transaction
+
+import ptah
+from ptah.testing import PtahTestCase
+
+
+class TestLocalRoles(PtahTestCase):
+
+    _includes = ('ptahcms',)
+
+    def setUp(self):
+        import ptahcms
+
+        global TestRolesContent, TestRolesContainer
+        class TestRolesContent(ptahcms.Content):
+            __type__ = ptahcms.Type('content', 'Test Content')
+            __uri_factory__ = ptah.UriFactory('type-content')
+
+        class TestRolesContainer(ptahcms.Container):
+            __type__ = ptahcms.Type('container', 'Test Container')
+            __uri_factory__ = ptah.UriFactory('type-container')
+
+        self.Content = TestRolesContent
+        self.Container = TestRolesContainer
+
+        super(TestLocalRoles, self).setUp()
+
+    def _make_tree(self):
+        container = self.Container(
+            __name__='container', __path__='/container/',
+            __local_roles__={'user:1': ['role:viewer', 'role:editor']})
+        folder = self.Container(title='Folder')
+        content = self.Content(
+            title='Content', __local_roles__={'user:1': ['role:owner'],
+                                              'user:2': ['role:viewer']})
+
+        container['folder'] = folder
+        folder['content'] = content
+
+        Session = ptah.get_session()
+        Session.add(container)
+        Session.flush()
+
+        return container, folder, content
+
+    def _rows(self):
+        from ptahcms.localroles import LocalRole
+
+        return sorted(
+            (r.node, r.principal, r.role)
+            for r in ptah.get_session().query(LocalRole))
+
+    def test_localroles_sync(self):
+        container, folder, content = self._make_tree()
+
+        self.assertEqual(self._rows(), sorted([
+            (container.__uri__, 'user:1', 'role:editor'),
+            (container.__uri__, 'user:1', 'role:viewer'),
+            (content.__uri__, 'user:1', 'role:owner'),
+            (content.__uri__, 'user:2', 'role:viewer')]))
+
+        # in place change, same as sharing forms
+        local_roles = folder.__local_roles__
+        local_roles['user:2'] = ['role:editor']
+        folder.__local_roles__ = local_roles
+
+        del content.__local_roles__['user:1']
+        ptah.get_session().flush()
+
+        self.assertEqual(self._rows(), sorted([
+            (container.__uri__, 'user:1', 'role:editor'),
+            (container.__uri__, 'user:1', 'role:viewer'),
+            (folder.__uri__, 'user:2', 'role:editor'),
+            (content.__uri__, 'user:2', 'role:viewer')]))
+
+    def test_localroles_query(self):
+        import ptahcms
+        container, folder, content = self._make_tree()
+        transaction.commit()
+
+        self.assertEqual(
+            ptahcms.get_node_roles('user:1', content.__uri__),
+            ['role:editor', 'role:owner', 'role:viewer'])
+        self.assertEqual(
+            ptahcms.get_node_roles('user:1', folder.__uri__),
+            ['role:editor', 'role:viewer'])
+        self.assertEqual(
+            ptahcms.get_node_roles('user:2', folder.__uri__), [])
+        self.assertEqual(
+            ptahcms.get_node_roles('user:3', content.__uri__), [])
+
+        self.assertEqual(
+            ptahcms.get_principal_nodes('user:1'),
+            sorted([container.__uri__, content.__uri__]))
+        self.assertEqual(
+            ptahcms.get_principal_nodes('user:1', ['role:owner']),
+            [content.__uri__])
+        self.assertEqual(
+            ptahcms.get_principal_nodes('user:2', ['role:editor']), [])
+
+    def test_localroles_delete(self):
+        container, folder, content = self._make_tree()
+        content_uri = content.__uri__
+
+        del folder['content']
+        ptah.get_session().flush()
+
+        self.assertNotIn(content_uri, [r[0] for r in self._rows()])
+
+    def test_localroles_delete_subtree(self):
+        from ptahcms.container import delete_subtree
+        container, folder, content = self._make_tree()
+        container_uri = container.__uri__
+
+        delete_subtree(folder)
+
+        self.assertEqual(
+            [r[0] for r in self._rows()], [container_uri, container_uri])
+
+    def test_localroles_rebuild(self):
+        from ptahcms.localroles import LocalRole, rebuild_local_roles
+        self._make_tree()
+
+        rows = self._rows()
+
+        Session = ptah.get_session()
+        Session.execute(LocalRole.__table__.delete())
+        self.assertEqual(self._rows(), [])
+
+        self.assertEqual(rebuild_local_roles(chunksize=3), 4)
+        self.assertEqual(self._rows(), rows)
+
+    def _make_acls_tree(self):
+        from ptah import config
+        from ptah.security import ID_ACL
+        from pyramid.security import Allow, Deny, ALL_PERMISSIONS
+        from ptahcms import View
+
+        acls = config.get_cfg_storage(ID_ACL)
+        acls['test-parent'] = [(Allow, 'role:editor', (View,))]
+        acls['test-owner'] = [(Allow, ptah.Owner.id, (View,))]
+        acls['test-deny'] = [(Deny, 'role:editor', ALL_PERMISSIONS),
+                             (Allow, ptah.Authenticated.id, (View,))]
+        acls['test-all'] = [(Allow, ptah.Everyone.id, ALL_PERMISSIONS)]
+
+        container = self.Container(
+            __name__='container', __path__='/container/',
+            __acls__=['test-parent'],
+            __local_roles__={'user:1': ['role:editor']})
+        container['a'] = self.Content(title='a')
+        container['b'] = self.Content(title='b', __acls__=['test-deny'])
+        container['c'] = self.Content(title='c', __owner__='user:2',
+                                      __acls__=['test-owner'])
+        container['d'] = self.Content(title='d', __owner__='user:1',
+                                      __acls__=['test-owner', 'test-deny'])
+        container['e'] = self.Content(
+            title='e', __acls__=['test-owner'],
+            __local_roles__={'user:2': [ptah.Owner.id]})
+        container['f'] = self.Content(title='f', __acls__=['test-all'])
+        container['g'] = self.Content(title='g', public=True)
+
+        ptah.get_session().add(container)
+        ptah.get_session().flush()
+        return container
+
+    def test_localroles_permission_clause(self):
+        import ptahcms
+        from ptahcms.localroles import permission_clause
+        container = self._make_acls_tree()
+
+        for userid, names in ((None, ['f']),
+                              ('user:1', ['a', 'c', 'd', 'e', 'f', 'g']),
+                              ('user:2', ['b', 'c', 'd', 'e', 'f']),
+                              (ptah.SUPERUSER_URI, list('abcdefg'))):
+            ptah.auth_service.set_userid(userid)
+
+            values, cursor = container.page(10, permission=ptahcms.View)
+            self.assertEqual([v.__name__ for v in values], names)
+            self.assertEqual(
+                [v.__name__ for v in ptahcms.filter_permitted(
+                    container.values(), ptahcms.View)], names)
+
+        ptah.auth_service.set_userid('user:1')
+        values, cursor = container.page(2, permission=ptahcms.View)
+        self.assertEqual([v.__name__ for v in values], ['a', 'c'])
+        values, cursor = container.page(2, cursor, permission=ptahcms.View)
+        self.assertEqual([v.__name__ for v in values], ['d', 'e'])
+
+        self.assertIsNotNone(permission_clause(container, ptahcms.View))
+
+    def test_localroles_permission_clause_default_roles(self):
+        import ptahcms
+        from ptah import config
+        from ptah.security import ID_ROLES_PROVIDER
+        from ptahcms.localroles import permission_clause
+        container = self._make_acls_tree()
+
+        self.assertIn('ptah_default_roles',
+                      config.get_cfg_storage(ID_ROLES_PROVIDER))
+
+        cfg = ptah.get_settings(ptah.CFG_ID_PTAH, self.registry)
+        cfg['default_roles'] = ['role:editor']
+        try:
+            ptah.auth_service.set_userid('user:2')
+            self.assertIsNotNone(permission_clause(container, ptahcms.View))
+
+            values, cursor = container.page(10, permission=ptahcms.View)
+            self.assertEqual([v.__name__ for v in values],
+                             ['a', 'c', 'e', 'f', 'g'])
+            self.assertEqual(
+                [v.__name__ for v in ptahcms.filter_permitted(
+                    container.values(), ptahcms.View)],
+                ['a', 'c', 'e', 'f', 'g'])
+        finally:
+            cfg['default_roles'] = []
+
+    def test_localroles_contents_page(self):
+        container = self._make_acls_tree()
+
+        ptah.auth_service.set_userid('user:2')
+        values, cursor = container.contents_page(3)
+        self.assertEqual([v.__name__ for v in values], ['b', 'c', 'd'])
+        self.assertEqual(cursor, 'd')
+
+        values, cursor = container.contents_page(3, cursor)
+        self.assertEqual([v.__name__ for v in values], ['e', 'f', 'g'])
+        self.assertIsNone(cursor)
+        self.assertEqual(container.contents_count(), 6)
+
+        ptah.auth_service.set_userid(None)
+        self.assertEqual(container.contents_count(), 2)
+        self.assertEqual(
+            [v.__name__ for v in container.contents_page(10)[0]], ['f', 'g'])
+
+    def test_localroles_contents_page_fallback(self):
+        from ptah import config
+        from ptah.security import ID_ROLES_PROVIDER
+        import ptahcms
+        from ptahcms.localroles import permission_clause
+        container = self._make_acls_tree()
+
+        def provider(context, userid, registry):
+            if context.__name__ == 'a':
+                return ['role:editor']
+            return ()
+
+        providers = config.get_cfg_storage(ID_ROLES_PROVIDER)
+        providers['test'] = provider
+        try:
+            ptah.auth_service.set_userid('user:2')
+            self.assertIsNone(permission_clause(container, ptahcms.View))
+
+            values, cursor = container.contents_page(4)
+            self.assertEqual([v.__name__ for v in values], ['a', 'b', 'c', 'd'])
+            self.assertEqual(cursor, 'd')
+            self.assertEqual(container.contents_count(), 7)
+        finally:
+            del providers['test']
@@ -144,3 +144,81 @@ class TestNode(PtahTestCase):
         c = ptah.get_session().query(ptahcms.Node).filter(
             ptahcms.Node.__uri__ == __uri).one()
         self.assertTrue(c.__acls__ == ['map1'])
+
+    def test_node_load_ancestors(self):
+        import ptahcms
+
+        class MyContent(ptahcms.Node):
+            __mapper_args__ = {'polymorphic_identity': 'mycontent'}
+            __uri_factory__ = ptah.UriFactory('test')
+
+        root = MyContent()
+        parent = MyContent(__parent__ = root)
+        content = MyContent(__parent__ = parent)
+        root_uri = root.__uri__
+        parent_uri = parent.__uri__
+        content_uri = content.__uri__
+
+        Session = ptah.get_session()
+        Session.add(root)
+        Session.add(parent)
+        Session.add(content)
+        transaction.commit()
+
+        content = ptah.get_session().query(ptahcms.Node).filter(
+            ptahcms.Node.__uri__ == content_uri).one()
+
+        ancestors = content._load_ancestors()
+        self.assertEqual(sorted(ancestors.keys()),
+                         sorted([root_uri, parent_uri]))
+
+        parents = ptahcms.load_parents(content)
+        self.assertEqual([p.__uri__ for p in parents], [parent_uri, root_uri])
+        self.assertIs(content.__parent__, ancestors[parent_uri])
+
+    def test_node_query(self):
+        import ptahcms
+        from ptahcms.node import node_query
+        from ptahcms.settings import CFG_ID_CMS
+
+        class MyContent(ptahcms.Node):
+            __mapper_args__ = {'polymorphic_identity': 'mycontent'}
+            __uri_factory__ = ptah.UriFactory('test')
+
+        parent = MyContent()
+        content = MyContent(__parent__ = parent)
+        parent_uri = parent.__uri__
+        content_uri = content.__uri__
+
+        Session = ptah.get_session()
+        Session.add(parent)
+        Session.add(content)
+        transaction.commit()
+
+        # lean query doesn't join tables of subclasses
+        self.assertIn('ptahcms_contents',
+                      str(node_query(ptahcms.Node).statement))
+        self.assertNotIn('ptahcms_contents',
+                         str(node_query(ptahcms.Node, lean=True).statement))
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        self.assertEqual(cfg['children_loading'], 'select')
+
+        parent = node_query(ptahcms.Node, lean=True).filter(
+            ptahcms.Node.__uri__ == parent_uri).one()
+        self.assertEqual([c.__uri__ for c in parent.__children__],
+                         [content_uri])
+        transaction.commit()
+
+        parent = node_query(ptahcms.Node, children='noload').filter(
+            ptahcms.Node.__uri__ == parent_uri).one()
+        self.assertEqual(parent.__children__, [])
+        transaction.rollback()
+
+        cfg['children_loading'] = 'joined'
+        parent = node_query(ptahcms.Node).filter(
+            ptahcms.Node.__uri__ == parent_uri).one()
+        self.assertIn('__children__', parent.__dict__)
+
+        cfg['children_loading'] = 'select'
+        transaction.commit()
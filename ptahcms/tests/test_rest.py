@@ -50,8 +50,8 @@ class TestRestApi(RestBase):
 
         srv = services['cms']
         self.assertEqual(srv.title, 'Ptah CMS API')
-        self.assertEqual(list(srv.actions.keys()),
-                         ['content', 'applications', 'apidoc', 'types'])
+        self.assertEqual(sorted(srv.actions.keys()),
+                         ['apidoc', 'applications', 'batch', 'content', 'types'])
 
     def test_rest_applications(self):
         from ptahcms.rest import cmsApplications
@@ -176,6 +176,100 @@ class TestRestApi(RestBase):
         info = cmsContent(request, root.__uri__)
         self.assertEqual(info['__uri__'], root.__uri__)
 
+    def test_rest_batch(self):
+        from ptahcms.rest import cmsBatch
+        ApplicationRoot = self._make_app()
+        self.init_ptah()
+
+        factory = ptahcms.ApplicationFactory(
+            ApplicationRoot, '/test', 'root', 'Root App', config=self.config)
+        root = factory(self.request)
+        uri = root.__uri__
+        transaction.commit()
+
+        request = DummyRequest(json_body=[
+            {'path': 'content:test'},
+            {'path': 'content:test/%s/update' % uri,
+             'POST': {'title': 'New title'}},
+            {'path': 'types'}])
+
+        results = cmsBatch(request)
+        self.assertEqual([r['status'] for r in results], [200, 200, 200])
+        self.assertEqual(results[0]['result']['__uri__'], uri)
+        self.assertEqual(results[1]['result']['title'], 'New title')
+        self.assertEqual(factory(request).title, 'New title')
+        transaction.commit()
+
+        request = DummyRequest(json_body=[
+            {'path': 'content:test/%s/update' % uri,
+             'POST': {'title': 'Other title'}},
+            {'path': 'content:test/unknown:1'},
+            {'path': 'types'}])
+
+        results = cmsBatch(request)
+        self.assertEqual([r['status'] for r in results], [200, 404])
+        self.assertEqual(request.response.status, '404 Not Found')
+        self.assertTrue(transaction.get().isDoomed())
+        transaction.abort()
+
+        self.assertEqual(factory(request).title, 'New title')
+
+    def test_rest_batch_errors(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        from ptahcms.rest import cmsBatch
+        self.init_ptah()
+
+        request = DummyRequest(json_body={'path': 'types'})
+        self.assertRaises(HTTPBadRequest, cmsBatch, request)
+
+        request = DummyRequest(json_body=[{'path': 'batch'}])
+        results = cmsBatch(request)
+        self.assertEqual(results[0]['status'], 400)
+        transaction.abort()
+
+        request = DummyRequest(json_body=[{'path': 'types'}, 'types',
+                                          {'path': 'types'}])
+        results = cmsBatch(request)
+        self.assertEqual([r['status'] for r in results], [200, 400])
+        self.assertTrue(transaction.get().isDoomed())
+        transaction.abort()
+
+    def test_rest_batch_exception(self):
+        from ptahcms.rest import CMS, cmsBatch
+        ApplicationRoot = self._make_app()
+        self.init_ptah()
+
+        factory = ptahcms.ApplicationFactory(
+            ApplicationRoot, '/test', 'root', 'Root App', config=self.config)
+        root = factory(self.request)
+        uri, title = root.__uri__, root.title
+        transaction.commit()
+
+        @CMS.action('failing', 'Failing action')
+        def failing(request, *args):
+            raise ValueError('Unexpected error')
+
+        try:
+            request = DummyRequest(json_body=[
+                {'path': 'content:test/%s/update' % uri,
+                 'POST': {'title': 'Other title'}},
+                {'path': 'failing'},
+                {'path': 'types'}])
+
+            results = cmsBatch(request)
+        finally:
+            del CMS.actions['failing']
+
+        self.assertEqual([r['status'] for r in results], [200, 500])
+        self.assertEqual(results[1]['result'],
+                         {'message': 'Unexpected error'})
+        self.assertEqual(request.response.status,
+                         '500 Internal Server Error')
+        self.assertTrue(transaction.get().isDoomed())
+        transaction.abort()
+
+        self.assertEqual(factory(request).title, title)
+
 
 class TestCMSRestAction(RestBase):
 
@@ -266,6 +360,71 @@ class TestCMSRestAction(RestBase):
         self.assertEqual(len(info['__contents__']), 1)
         self.assertEqual(info['__contents__'][0]['__uri__'],
                          container['content'].__uri__)
+        self.assertIsNone(info['__next__'])
+
+    def test_rest_cms_container_info_page(self):
+        from ptahcms import rest
+        self.init_ptah()
+
+        container = Container()
+        container['content1'] = Content()
+        container['content2'] = Content()
+        container['content3'] = Content()
+
+        request = DummyRequest(params = {'limit': '2'})
+        info = rest.containerNodeInfo(container, request)
+        self.assertEqual([c['__name__'] for c in info['__contents__']],
+                         ['content1', 'content2'])
+        self.assertEqual(info['__next__'], 'content2')
+
+        request = DummyRequest(params = {'limit': '2', 'after': 'content2'})
+        info = rest.containerNodeInfo(container, request)
+        self.assertEqual([c['__name__'] for c in info['__contents__']],
+                         ['content3'])
+        self.assertIsNone(info['__next__'])
+
+    def test_rest_cms_container_info_page_size(self):
+        from ptahcms import rest
+        from ptahcms.settings import CFG_ID_CMS
+        self.init_ptah()
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['rest_page_size'] = 2
+        self.addCleanup(cfg.__setitem__, 'rest_page_size', 1000)
+
+        container = Container()
+        container['content1'] = Content()
+        container['content2'] = Content()
+        container['content3'] = Content()
+
+        # contents are always paginated
+        info = rest.containerNodeInfo(container, DummyRequest())
+        self.assertEqual([c['__name__'] for c in info['__contents__']],
+                         ['content1', 'content2'])
+        self.assertEqual(info['__next__'], 'content2')
+
+        # limit is not larger than page size
+        request = DummyRequest(params = {'limit': '5'})
+        info = rest.containerNodeInfo(container, request)
+        self.assertEqual([c['__name__'] for c in info['__contents__']],
+                         ['content1', 'content2'])
+
+    def test_rest_cms_container_info_page_invalid(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        from ptahcms import rest
+        self.init_ptah()
+
+        container = Container()
+        container['content1'] = Content()
+
+        for params in ({'limit': 'ten'}, {'limit': '-1'},
+                       {'limit': '2', 'order': 'title'},
+                       {'limit': '2', 'order': 'created', 'after': 'content1'},
+                       {'limit': '2', 'order': 'modified',
+                        'after': '2012-13-45/content1'}):
+            request = DummyRequest(params = params)
+            self.assertRaises(
+                HTTPBadRequest, rest.containerNodeInfo, container, request)
 
     def test_rest_cms_delete(self):
         from ptahcms import rest
@@ -277,6 +436,24 @@ class TestCMSRestAction(RestBase):
         rest.deleteAction(container['content'], self.request)
         self.assertEqual(container.keys(), [])
 
+    def test_rest_cms_batchdelete(self):
+        from webob.multidict import MultiDict
+        from ptahcms import rest
+        self.init_ptah()
+
+        container = Container(__name__='container', __path__='/container/')
+        container['content1'] = Content()
+        container['content2'] = Content()
+        container['content3'] = Content()
+        uris = [container['content1'].__uri__, container['content3'].__uri__]
+
+        request = DummyRequest(
+            post = MultiDict([('uri', uris[0]), ('uri', uris[1])]))
+
+        info = rest.batchDeleteAction(container, request)
+        self.assertEqual(info['deleted'], uris)
+        self.assertEqual(container.keys(), ['content2'])
+
     def test_rest_cms_update(self):
         from ptahcms import rest
         self.init_ptah()
@@ -264,3 +264,207 @@ class TestRestApi(PtahTestCase):
 
         res = json.loads(Api(request).text)
         self.assertIn('dt', res)
+
+    def test_rest_response_compact(self):
+        from ptahcms.restsrv import Api, ID_REST
+        self.init_ptah()
+
+        services = config.get_cfg_storage(ID_REST)
+
+        def service(request, action, *args):
+            return {'items': [1, 2, 3]}
+
+        services['test'] = service
+
+        request = DummyRequest()
+        request.matchdict = {'service': 'test', 'subpath': ('action',)}
+
+        res = Api(request)
+        self.assertEqual(res.content_type, 'application/json')
+        self.assertEqual(res.body, b'{"items":[1,2,3]}')
+
+    def test_rest_response_pretty(self):
+        from ptahcms.restsrv import Api, ID_REST
+        from ptahcms.settings import CFG_ID_CMS
+        self.init_ptah()
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['rest_pretty_json'] = True
+
+        services = config.get_cfg_storage(ID_REST)
+
+        def service(request, action, *args):
+            return {'items': [1]}
+
+        services['test'] = service
+
+        request = DummyRequest()
+        request.matchdict = {'service': 'test', 'subpath': ('action',)}
+
+        res = Api(request)
+        self.assertEqual(json.loads(res.text), {'items': [1]})
+        self.assertIn('\n  "items"', res.text)
+
+        cfg['rest_pretty_json'] = False
+
+    def test_rest_json_iter(self):
+        from ptahcms.restsrv import JSONIter
+
+        result = {'items': list(range(100))}
+
+        it = JSONIter(result)
+        it.bufsize = 10
+        chunks = list(it)
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(all(len(c) >= 10 for c in chunks[:-1]))
+        self.assertEqual(json.loads(b''.join(chunks).decode('utf-8')), result)
+
+    def test_rest_json_backends(self):
+        from ptahcms import restsrv
+
+        self.assertIs(restsrv.get_json_backend('json'), restsrv.JSONIter)
+        self.assertIs(restsrv.get_json_backend('unknown'), restsrv.JSONIter)
+
+        if restsrv.orjson is None: # pragma: no cover
+            self.assertIs(restsrv.get_json_backend('auto'), restsrv.JSONIter)
+            return
+
+        self.assertIs(restsrv.get_json_backend('auto'), restsrv.orjson_iter)
+
+        import datetime
+        result = {'dt': datetime.datetime(2012, 1, 2, 3, 4, 5),
+                  'items': [1, 'test', None], 1: True}
+
+        data = b''.join(restsrv.orjson_iter(result))
+        self.assertEqual(data, b''.join(restsrv.JSONIter(result)))
+        self.assertEqual(
+            json.loads(b''.join(restsrv.orjson_iter(result, True))
+                       .decode('utf-8')),
+            json.loads(data.decode('utf-8')))
+
+    def test_rest_json_backend_setting(self):
+        from ptahcms.restsrv import Api, ID_REST, JSONIter
+        from ptahcms.settings import CFG_ID_CMS
+        self.init_ptah()
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['rest_json_backend'] = 'json'
+
+        services = config.get_cfg_storage(ID_REST)
+        services['test'] = lambda request, action, *args: {'items': [1]}
+
+        request = DummyRequest()
+        request.matchdict = {'service': 'test', 'subpath': ('action',)}
+
+        res = Api(request)
+        self.assertIsInstance(res.app_iter, JSONIter)
+        self.assertEqual(res.body, b'{"items":[1]}')
+
+        cfg['rest_json_backend'] = 'auto'
+
+
+class TestRestTokenCache(PtahTestCase):
+
+    _init_ptah = False
+    _settings = {'auth.secret': 'test'}
+
+    def tearDown(self):
+        from ptahcms.restsrv import token_cache
+        token_cache.clear()
+        super(TestRestTokenCache, self).tearDown()
+
+    def _login(self):
+        from ptahcms.restsrv import Login
+        from ptah import authentication
+
+        config.get_cfg_storage(
+            authentication.AUTH_PROVIDER_ID)['test'] = Provider()
+
+        request = DummyRequest(
+            params = {'login': 'admin', 'password': '12345'})
+        return json.loads(Login(request)().text)['auth-token']
+
+    def _api(self, token):
+        from ptahcms.restsrv import Api
+
+        ptah.auth_service.set_userid(None)
+
+        request = DummyRequest(environ = {'HTTP_X_AUTH_TOKEN': token})
+        request.matchdict = {'service': 'cms', 'subpath': ()}
+        Api(request)
+        return ptah.auth_service.get_userid()
+
+    def test_rest_token_cache(self):
+        from ptahcms.restsrv import token_cache
+        self.init_ptah()
+
+        token = self._login()
+        self.assertEqual(self._api(token), 'testprincipal:1')
+        self.assertEqual(len(token_cache), 1)
+
+        key = token_cache.key('test', token)
+        self.assertEqual(token_cache.get(key), 'testprincipal:1')
+
+        # cached token is not verified again
+        token_cache.set(key, 'testprincipal:2', 10, 300)
+        self.assertEqual(self._api(token), 'testprincipal:2')
+
+        # unknown tokens are not cached
+        self.assertIsNone(self._api('unknown'))
+        self.assertEqual(len(token_cache), 1)
+
+    def test_rest_token_cache_disabled(self):
+        from ptahcms.restsrv import token_cache
+        from ptahcms.settings import CFG_ID_CMS
+        self.init_ptah()
+
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['rest_token_cache_size'] = 0
+
+        self.assertEqual(self._api(self._login()), 'testprincipal:1')
+        self.assertEqual(len(token_cache), 0)
+
+        cfg['rest_token_cache_size'] = 1000
+
+    def test_rest_token_cache_bounds(self):
+        from ptahcms.restsrv import TokenCache
+
+        cache = TokenCache()
+        cache.set('1', 'user:1', 2, 300)
+        cache.set('2', 'user:2', 2, 300)
+        cache.get('1')
+        cache.set('3', 'user:1', 2, 300)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('2'))
+        self.assertEqual(cache.get('1'), 'user:1')
+
+        cache.set('4', 'user:4', 2, -1)
+        self.assertIsNone(cache.get('4'))
+
+    def test_rest_token_cache_logout(self):
+        from ptahcms.restsrv import token_cache
+        self.init_ptah()
+
+        token_cache.set('1', 'testprincipal:1', 10, 300)
+        token_cache.set('2', 'testprincipal:2', 10, 300)
+
+        self.registry.notify(
+            ptah.events.LoggedOutEvent(Principal()))
+
+        self.assertIsNone(token_cache.get('1'))
+        self.assertEqual(token_cache.get('2'), 'testprincipal:2')
+
+    def test_rest_token_cache_secret(self):
+        from ptahcms.restsrv import token_cache
+        self.init_ptah()
+
+        token_cache.set('1', 'testprincipal:1', 10, 300)
+
+        cfg = ptah.get_settings(ptah.CFG_ID_PTAH, self.registry)
+        self.registry.notify(ptah.events.SettingsGroupModified(cfg))
+
+        self.assertEqual(len(token_cache), 0)
+        self.assertNotEqual(token_cache.key('test', 'token'),
+                            token_cache.key('secret', 'token'))
@@ -83,6 +83,26 @@ class TestAction(PtahTestCase):
         self.assertIn('update', actions)
         self.assertIn('create', actions)
 
+    def test_cms_action_table(self):
+        import ptahcms
+        from ptahcms.security import ActionTable, build_class_actions
+
+        class Test(object):
+            @ptahcms.action(permission='perm')
+            def update(self, **data): # pragma: no cover
+                pass
+
+        actions = build_class_actions(Test)
+        self.assertIsInstance(actions, ActionTable)
+        self.assertNotIsInstance(Test.__ptahcms_actions__, ActionTable)
+        self.assertEqual(actions['update'], ('update', 'perm'))
+        self.assertEqual(list(actions), ['update'])
+        self.assertRaises(AttributeError, setattr, actions, '_actions', {})
+
+        fname, checker = actions.dispatch['update']
+        self.assertEqual(fname, 'update')
+        self.assertEqual(checker.args, ('perm',))
+
 
 class TestWrapper(PtahTestCase):
 
@@ -125,6 +145,25 @@ class TestWrapper(PtahTestCase):
         wrapper = NodeWrapper(Test())
         self.assertEqual(wrapper.update(), 'test')
 
+    def test_cms_wrapper_reuse(self):
+        import ptah, ptahcms
+        from ptahcms.security import NodeWrapper, wrap, class_actions
+
+        class Test(object):
+            @ptahcms.action(permission=ptah.NO_PERMISSION_REQUIRED)
+            def update(self, *args, **data):
+                return 'test'
+
+        actions = dict(Test.__ptahcms_actions__)
+
+        wrapper = NodeWrapper(Test())
+        self.assertIs(wrap(wrapper), wrapper)
+        self.assertIs(NodeWrapper(Test())._actions, wrapper._actions)
+        self.assertIs(wrapper._actions, class_actions(Test))
+
+        # content class is not changed
+        self.assertEqual(Test.__dict__['__ptahcms_actions__'], actions)
+
 
 class TestCms(PtahTestCase):
 
@@ -152,6 +191,39 @@ class TestCms(PtahTestCase):
         self.assertIsInstance(wrapper, NodeWrapper)
         self.assertIs(wrapper._content, t)
 
+    def test_cms_parents_lazy(self):
+        import ptah
+        from ptahcms.security import wrap
+
+        class Test(ptahcms.Content):
+            __uri_factory__ = ptah.UriFactory('test')
+
+            @ptahcms.action(permission=ptah.NO_PERMISSION_REQUIRED)
+            def update(self, *args, **data):
+                return 'update'
+
+            @ptahcms.action(permission=ptah.NOT_ALLOWED)
+            def remove(self, *args, **data): # pragma: no cover
+                pass
+
+        loaded = []
+        orig_load_parents = ptahcms.load_parents
+        ptahcms.load_parents = lambda content: loaded.append(content)
+        try:
+            t = Test()
+            wrapper = wrap(t)
+            self.assertEqual(loaded, [])
+
+            # parents are loaded once, before permission check
+            self.assertEqual(wrapper.update(), 'update')
+            self.assertEqual(loaded, [])
+
+            self.assertRaises(ptahcms.Forbidden, wrapper.__getattr__, 'remove')
+            self.assertRaises(ptahcms.Forbidden, wrapper.__getattr__, 'remove')
+            self.assertEqual(loaded, [t])
+        finally:
+            ptahcms.load_parents = orig_load_parents
+
     def test_cms_2(self):
         import ptah
         from ptahcms.security import wrap, NodeWrapper
@@ -174,3 +246,260 @@ class TestCms(PtahTestCase):
         wrapper = wrap('test:1')
         self.assertIsInstance(wrapper, NodeWrapper)
         self.assertIs(wrapper._content, t)
+
+
+class TestFilterPermitted(PtahTestCase):
+
+    def _make_tree(self):
+        import ptah
+        from zope.interface import implementer
+        from pyramid.security import Allow, Deny
+
+        @implementer(ptah.ILocalRolesAware, ptah.IOwnersAware)
+        class Item(object):
+            __acl__ = ()
+            __owner__ = ''
+            __local_roles__ = {}
+
+            def __init__(self, parent=None, **kw):
+                self.__parent__ = parent
+                self.__dict__.update(kw)
+
+        root = Item(__acl__=[(Allow, 'role:editor', ('perm',)),
+                             (Allow, ptah.Owner.id, ('perm',))])
+        folder = Item(root, __local_roles__={'user:1': ['role:editor']},
+                      __acl__=[(Deny, 'user:2', 'perm')])
+
+        items = [Item(folder),
+                 Item(folder, __acl__=[(Deny, 'role:editor', ptah.ALL_PERMISSIONS)]),
+                 Item(folder, __owner__='user:2'),
+                 Item(folder, __owner__='user:3'),
+                 Item(folder, __local_roles__={'user:3': ['role:editor']}),
+                 Item(None, __acl__=[(Allow, ptah.Everyone.id, 'perm')]),
+                 Item(root)]
+        return items
+
+    def _check(self, items, permission='perm'):
+        import ptah
+        from ptahcms import filter_permitted
+
+        expected = [item for item in items
+                    if ptah.check_permission(permission, item)]
+        self.assertEqual(filter_permitted(items, permission), expected)
+        return expected
+
+    def test_filter_permitted(self):
+        import ptah
+        items = self._make_tree()
+
+        for userid in (None, 'user:1', 'user:2', 'user:3'):
+            ptah.auth_service.set_userid(userid)
+            self._check(items)
+
+        ptah.auth_service.set_userid('user:1')
+        self.assertEqual(self._check(items), [items[0], items[2], items[3],
+                                              items[4], items[5]])
+
+        ptah.auth_service.set_userid('user:3')
+        self.assertEqual(self._check(items), [items[3], items[4], items[5]])
+
+    def test_filter_permitted_special(self):
+        import ptah
+        from ptahcms import filter_permitted
+        items = self._make_tree()
+
+        self.assertEqual(
+            filter_permitted(items, ptah.NO_PERMISSION_REQUIRED), items)
+        self.assertEqual(filter_permitted(items, ptah.NOT_ALLOWED), [])
+
+        ptah.auth_service.set_userid(ptah.SUPERUSER_URI)
+        self.assertEqual(filter_permitted(items, 'perm'), items)
+
+    def test_filter_permitted_roles_provider(self):
+        import ptah
+        from ptah.security import ID_ROLES_PROVIDER
+        items = self._make_tree()
+
+        def provider(context, userid, registry):
+            if context is items[6]:
+                return ['role:editor']
+            return ()
+
+        providers = config.get_cfg_storage(ID_ROLES_PROVIDER)
+        providers['test'] = provider
+        try:
+            ptah.auth_service.set_userid('user:3')
+            self.assertIn(items[6], self._check(items))
+        finally:
+            del providers['test']
+
+    def test_filter_permitted_custom_check(self):
+        import ptah
+        from ptahcms import filter_permitted
+        items = self._make_tree()
+
+        orig_check_permission = ptah.check_permission
+        ptah.check_permission = lambda p, content, r=None, t=False: \
+            content is items[0]
+        try:
+            self.assertEqual(filter_permitted(items, 'perm'), [items[0]])
+        finally:
+            ptah.check_permission = orig_check_permission
+
+
+class TestCheckPermission(PtahTestCase):
+
+    def _memo(self):
+        from ptahcms.security import PERMISSIONS_KEY
+        memo = getattr(self.request, PERMISSIONS_KEY, None)
+        return memo[1] if memo is not None else None
+
+    def test_check_permission_memo(self):
+        import ptah, ptahcms
+        from pyramid.security import Allow
+        from pyramid.httpexceptions import HTTPForbidden
+        from ptahcms.security import check_permission
+
+        class Test(ptahcms.Content):
+            __uri_factory__ = ptah.UriFactory('test')
+
+        content = Test()
+        content.__acl__ = [(Allow, 'role:editor', 'perm')]
+        content.__parent__ = ptahcms.ApplicationPolicy(self.request)
+
+        ptah.auth_service.set_userid('user:1')
+        self.assertFalse(check_permission('perm', content))
+        self.assertEqual(self._memo(),
+                         {('user:1', content.__uri__, 'perm'): False})
+
+        # result is memoized
+        content.__acl__ = [(Allow, 'user:1', 'perm')]
+        self.assertFalse(check_permission('perm', content))
+        self.assertRaises(
+            HTTPForbidden, check_permission, 'perm', content, None, True)
+
+        # local roles change clears memo
+        content.__local_roles__ = {'user:1': ['role:editor']}
+        self.assertIsNone(self._memo())
+        self.assertTrue(check_permission('perm', content))
+        self.assertTrue(check_permission('perm', content, None, True))
+
+        # memo is per principal
+        ptah.auth_service.set_userid('user:2')
+        self.assertFalse(check_permission('perm', content))
+
+        content.__acls__ = []
+        self.assertIsNone(self._memo())
+
+    def test_check_permission_memo_in_place(self):
+        import ptah, ptahcms
+        from pyramid.security import Allow
+        from ptahcms.security import check_permission
+
+        class Test(ptahcms.Content):
+            __uri_factory__ = ptah.UriFactory('test')
+
+        class TestContainer(ptahcms.Container):
+            __uri_factory__ = ptah.UriFactory('test-container')
+
+        content = Test(__acls__=[])
+        content.__acl__ = [(Allow, 'role:editor', 'perm'),
+                           (Allow, ptah.Owner.id, 'perm')]
+        content.__parent__ = ptahcms.ApplicationPolicy(self.request)
+
+        ptah.auth_service.set_userid('user:1')
+        self.assertFalse(check_permission('perm', content))
+
+        # in place change of local roles
+        content.__local_roles__['user:1'] = ['role:editor']
+        self.assertIsNone(self._memo())
+        self.assertTrue(check_permission('perm', content))
+
+        del content.__local_roles__['user:1']
+        self.assertIsNone(self._memo())
+        self.assertFalse(check_permission('perm', content))
+
+        # in place change of acls
+        content.__acls__.append('test-acl')
+        self.assertIsNone(self._memo())
+        self.assertFalse(check_permission('perm', content))
+
+        # owner change
+        content.__owner__ = 'user:1'
+        self.assertIsNone(self._memo())
+        self.assertTrue(check_permission('perm', content))
+
+        # move
+        container = TestContainer(__name__='container', __path__='/container/')
+        ptah.get_session().add(container)
+        ptah.get_session().flush()
+        self.assertTrue(check_permission('perm', content))
+        self.assertIsNotNone(self._memo())
+
+        container['content'] = content
+        self.assertIsNone(self._memo())
+
+    def test_check_permission_lineage_not_loaded(self):
+        import ptah, ptahcms
+        from pyramid.security import Allow
+        from ptahcms.security import check_permission
+
+        class Test(ptahcms.Content):
+            __uri_factory__ = ptah.UriFactory('test')
+
+        content = Test()
+        content.__acl__ = [(Allow, 'user:1', 'perm')]
+
+        # parents are not loaded, result is not memoized
+        ptah.auth_service.set_userid('user:1')
+        self.assertTrue(check_permission('perm', content))
+        self.assertIsNone(self._memo())
+
+        content.__parent__ = ptahcms.ApplicationPolicy(self.request)
+        self.assertTrue(check_permission('perm', content))
+        self.assertEqual(self._memo(),
+                         {('user:1', content.__uri__, 'perm'): True})
+
+    def test_check_permission_memo_transaction(self):
+        import ptah, ptahcms
+        import transaction
+        from pyramid.security import Allow
+        from pyramid.threadlocal import manager
+        from ptahcms.security import check_permission
+
+        class Test(ptahcms.Content):
+            __uri_factory__ = ptah.UriFactory('test')
+
+        content = Test()
+        content.__acl__ = [(Allow, 'user:1', 'perm')]
+        content.__parent__ = ptahcms.ApplicationPolicy(self.request)
+
+        ptah.auth_service.set_userid('user:1')
+        self.assertTrue(check_permission('perm', content))
+
+        # memo is not shared between transactions
+        transaction.abort()
+        content.__acl__ = []
+        self.assertFalse(check_permission('perm', content))
+        self.assertEqual(self._memo(),
+                         {('user:1', content.__uri__, 'perm'): False})
+
+        # no memo without request
+        manager.push({'registry': self.registry, 'request': None})
+        try:
+            content.__acl__ = [(Allow, 'user:1', 'perm')]
+            self.assertTrue(check_permission('perm', content))
+        finally:
+            manager.pop()
+
+        self.assertEqual(self._memo(),
+                         {('user:1', content.__uri__, 'perm'): False})
+
+    def test_check_permission_not_node(self):
+        import ptah
+        from ptahcms.security import check_permission
+
+        self.assertTrue(
+            check_permission(ptah.NO_PERMISSION_REQUIRED, object()))
+        self.assertFalse(check_permission('perm', object()))
+        self.assertIsNone(self._memo())
@@ -191,3 +191,67 @@ class TestTraverser(PtahTestCase):
         self.assertEqual(info['context'].__uri__, self.content_uri)
         self.assertEqual(info['view_name'], 'index.html')
         self.assertEqual(info['traversed'], ('folder','content'))
+
+    def test_traverser_path_cache(self):
+        from ptahcms.settings import CFG_ID_CMS
+        from ptahcms.traverser import ContentTraverser
+
+        self._create_content()
+
+        cache = ContentTraverser._path_cache
+        cache.clear()
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['traverser_cache_size'] = 10
+
+        request = self.make_request(
+            environ={'PATH_INFO': '/test/folder/content/index.html'})
+
+        root = self.factory(request)
+        traverser = self.registry.getAdapter(root, ITraverser)
+        traverser(request)
+        self.assertEqual(len(cache), 1)
+        transaction.commit()
+
+        root = self.factory(request)
+        traverser = self.registry.getAdapter(root, ITraverser)
+
+        info = traverser(request)
+        self.assertEqual(info['context'].__uri__, self.content_uri)
+        self.assertEqual(info['context'].__parent__.__uri__, self.folder_uri)
+        self.assertEqual(info['view_name'], 'index.html')
+        self.assertEqual(info['traversed'], ('folder','content'))
+
+        self.registry.notify(ptah.events.UriInvalidateEvent(self.folder_uri))
+        self.assertEqual(len(cache), 0)
+
+        cfg['traverser_cache_size'] = 0
+        cache.clear()
+
+    def test_traverser_path_cache_stale(self):
+        from ptahcms.settings import CFG_ID_CMS
+        from ptahcms.traverser import ContentTraverser
+
+        self._create_content()
+
+        cache = ContentTraverser._path_cache
+        cache.clear()
+        cfg = ptah.get_settings(CFG_ID_CMS, self.registry)
+        cfg['traverser_cache_size'] = 10
+
+        request = self.make_request(
+            environ={'PATH_INFO': '/test/folder/content/'})
+
+        root = self.factory(request)
+        cache.set('/test/folder/content/',
+                  ((0, self.content_uri, '/test/folder/content/'),), 10, 300)
+
+        traverser = self.registry.getAdapter(root, ITraverser)
+        info = traverser(request)
+        self.assertEqual(info['context'].__uri__, self.content_uri)
+        self.assertEqual(info['traversed'], ('folder','content'))
+
+        cache.invalidate_path('/test/folder/')
+        self.assertEqual(len(cache), 0)
+
+        cfg['traverser_cache_size'] = 0
+        cache.clear()
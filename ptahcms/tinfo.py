@@ -6,6 +6,7 @@ import ptah
 from ptah import config
 from ptah.typeinfo import TYPES_DIR_ID, TypeInformation
 
+from ptahcms.node import node_query, idmap_get, idmap_add
 from ptahcms.content import Content
 from ptahcms.container import BaseContainer
 from ptahcms.security import build_class_actions
@@ -78,9 +79,15 @@ def Type(name, title=None, fieldset=None, **kw):
         f_locals['__uri_factory__'] = ptah.UriFactory(schema)
 
         def resolve_content(uri):
-            return typeinfo.cls.__uri_sql_get__.first(uri=uri)
+            item = idmap_get(uri)
+            if item is None:
+                item = typeinfo.cls.__uri_sql_get__.first(uri=uri)
+                if item is not None:
+                    idmap_add(item)
+            return item
 
         resolve_content.__doc__ = 'CMS Content resolver for %s type'%name
+        resolve_content.__node_resolver__ = True
 
         ptah.resolver(schema, 2)(resolve_content)
 
@@ -132,7 +139,7 @@ def register_type_impl(
 
     # sql query for content resolver
     cls.__uri_sql_get__ = ptah.QueryFreezer(
-        lambda: ptah.get_session().query(cls) \
+        lambda: node_query(cls, lean=True) \
             .filter(cls.__uri__ == sqla.sql.bindparam('uri')))
 
     # build cms actions
@@ -1,23 +1,138 @@
 """ content traverser """
+import time
+import threading
+import sqlalchemy as sqla
 from sqlalchemy import sql
+from collections import OrderedDict
 from zope import interface
 from pyramid.interfaces import ITraverser
 from pyramid.traversal import traversal_path, ResourceTreeTraverser
 
 import ptah
+from ptahcms.node import node_query, idmap_add
 from ptahcms.content import BaseContent
+from ptahcms.settings import CFG_ID_CMS
 from ptahcms.interfaces import IApplicationRoot
 
 
+class PathCache(object):
+    """ Bounded LRU cache of resolved request paths. Every entry is
+    a chain of `(id, uri, path)` tuples of content objects, deepest first.
+    Entry expires after `ttl` seconds, because invalidation works only
+    within current process. """
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._uris = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+
+            expires, chain = entry
+            if expires < time.time():
+                self._remove(key, chain)
+                return None
+
+            self._data[key] = entry
+            return chain
+
+    def set(self, key, chain, size, ttl):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._remove(key, entry[1])
+
+            self._data[key] = (time.time() + ttl, chain)
+            for _id, uri, path in chain:
+                self._uris.setdefault(uri, set()).add(key)
+
+            while len(self._data) > size:
+                old_key, (expires, old_chain) = self._data.popitem(False)
+                self._remove(old_key, old_chain)
+
+    def invalidate(self, uri):
+        """ Remove all paths which are resolved through `uri` """
+        with self._lock:
+            for key in self._uris.pop(uri, ()):
+                entry = self._data.pop(key, None)
+                if entry is not None:
+                    self._remove(key, entry[1])
+
+    def invalidate_path(self, path):
+        """ Remove all paths which start with `path` """
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(path)]:
+                self._remove(key, self._data.pop(key)[1])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._uris.clear()
+
+    def _remove(self, key, chain):
+        for _id, uri, path in chain:
+            keys = self._uris.get(uri)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._uris[uri]
+
+
 @interface.implementer(ITraverser)
 class ContentTraverser(object):
     """ Custom content traverser """
 
     _path_queries = {}
+    _id_queries = {}
+    _path_cache = PathCache()
 
     def __init__(self, root):
         self.root = root
 
+    def _load_chain(self, chain, queries=_id_queries):
+        """ Load cached chain, objects from session identity map are
+        reused, rest is loaded by primary key with one query. """
+        Session = ptah.get_session()
+        mapper = sqla.orm.class_mapper(BaseContent)
+
+        items = {}
+        missing = {}
+        for id, uri, path in chain:
+            item = Session.identity_map.get(
+                mapper.identity_key_from_primary_key((id,)))
+            if item is not None:
+                items[id] = item
+            else:
+                missing[str(len(missing))] = id
+
+        idx = len(missing)
+        if idx:
+            if idx not in queries:
+                bindparams = [sql.bindparam(str(p)) for p in range(idx)]
+
+                queries[idx] = ptah.QueryFreezer(
+                    lambda: node_query(BaseContent, lean=True)\
+                        .filter(BaseContent.__id__.in_(bindparams)))
+
+            for item in queries[idx].all(**missing):
+                items[item.__id__] = item
+
+        parents = []
+        for id, uri, path in chain:
+            item = items.get(id)
+            if item is None or item.__uri__ != uri or item.__path__ != path:
+                return None
+            parents.append(item)
+
+        return parents
+
     def __call__(self, request, queries=_path_queries):
         environ = request.environ
         context = root = self.root
@@ -41,17 +156,33 @@ class ContentTraverser(object):
                 paths[str(idx)] = current
                 idx += 1
 
+        parents = None
+        cache_size = 0
         if idx:
+            cfg = ptah.get_settings(CFG_ID_CMS, request.registry)
+            cache_size = cfg['traverser_cache_size']
+            if cache_size:
+                chain = self._path_cache.get(current)
+                if chain is not None:
+                    parents = self._load_chain(chain)
+
+        if parents is None and idx:
             if idx not in queries:
                 bindparams = [sql.bindparam(str(p)) for p in range(idx)]
 
                 queries[idx] = ptah.QueryFreezer(
-                    lambda: ptah.get_session().query(BaseContent)\
+                    lambda: node_query(BaseContent, lean=True)\
                         .filter(BaseContent.__path__.in_(bindparams)))
 
             parents = sorted(queries[idx].all(**paths), reverse=True,
                              key = lambda item: item.__path__)
-        else:
+
+            if cache_size:
+                self._path_cache.set(
+                    current,
+                    tuple((p.__id__, p.__uri__, p.__path__) for p in parents),
+                    cache_size, cfg['traverser_cache_ttl'])
+        elif parents is None:
             parents = []
 
         if parents:
@@ -59,6 +190,7 @@ class ContentTraverser(object):
             parents[-1].__parent__ = root
             for idx in range(len(parents)-1):
                 parents[idx].__parent__ = parents[idx+1]
+            idmap_add(*parents)
 
             context = parents[0]
             node = context.__path__[len(root.__path__):]
@@ -85,3 +217,18 @@ class ContentTraverser(object):
                     'virtual_root': root,
                     'virtual_root_path': (),
                     'root': root}
+
+
+@ptah.subscriber(ptah.events.UriInvalidateEvent)
+def uri_invalidated_handler(ev):
+    """ Evict cached request paths resolved through invalidated uri """
+    ContentTraverser._path_cache.invalidate(ev.uri)
+
+
+@ptah.subscriber(ptah.events.ContentAddedEvent)
+@ptah.subscriber(ptah.events.ContentMovedEvent)
+def content_added_handler(ev):
+    """ New content can shadow view names of cached request paths """
+    path = getattr(ev.object, '__path__', None)
+    if path:
+        ContentTraverser._path_cache.invalidate_path(path)
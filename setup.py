@@ -55,6 +55,11 @@ setup(name='ptahcms',
           'pyramid.scaffold': [
               'ptahcms = ptahcms.scaffolds:PtahCMSProjectTemplate',
               ],
+          'console_scripts': [
+              'ptahcms-blobgc = ptahcms.scripts:blobgc',
+              'ptahcms-localroles = ptahcms.scripts:localroles',
+              'ptahcms-jsonbench = ptahcms.scripts:jsonbench',
+              ],
           },
       message_extractors={'ptahcms': [
         ('migrations/**', 'ignore', None),